@@ -0,0 +1,213 @@
+import os
+import sys
+import json
+import time
+import shutil
+import py_compile
+import argparse
+import tempfile
+import contextlib
+import statistics
+import subprocess
+
+from stub_server import start_stub_server, alias_album_id
+
+# Stages timed inside a single render, as (label, posterfy function name)
+STAGES = [
+    ("get_album_details", "get_album_details"),
+    ("download_album_cover", "download_album_cover"),
+    ("create_spotify_code", "create_spotify_code"),
+    ("layout", "plan_layout"),
+]
+
+# Function to wrap a function so every call's duration is appended to timings[label]
+def timed(label, func, timings):
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            timings.setdefault(label, []).append(time.perf_counter() - start)
+    return wrapper
+
+# Function to time the render stages by wrapping the posterfy functions that implement them
+def install_stage_timers(posterfy, timings):
+    for label, function_name in STAGES:
+        setattr(posterfy, function_name, timed(label, getattr(posterfy, function_name), timings))
+    from reportlab.pdfgen import canvas
+    canvas.Canvas.save = timed("save", canvas.Canvas.save, timings)
+
+# Dependencies that importing posterfy must not load; each stage imports what it needs
+HEAVY_MODULES = ["spotipy", "requests", "PIL", "reportlab", "qrcode", "dotenv", "concurrent.futures", "http.server"]
+
+# A .env like the one the README has every user create, so the import is measured as it runs for them
+BENCH_ENV_FILE = "SPOTIFY_CLIENT_ID=bench_client_id\nSPOTIFY_CLIENT_SECRET=bench_client_secret\n"
+
+# Function to measure how long a fresh interpreter takes to import posterfy, and what it pulls in
+# posterfy is imported from a copy next to a .env file, since reading it is part of every real start-up
+def bench_import(iterations, work_dir):
+    package_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    import_dir = tempfile.mkdtemp(dir=work_dir)
+    shutil.copy(os.path.join(package_dir, "posterfy.py"), import_dir)
+    py_compile.compile(os.path.join(import_dir, "posterfy.py"))  # Even under PYTHONDONTWRITEBYTECODE
+    with open(os.path.join(import_dir, ".env"), "w", encoding="utf-8") as f:
+        f.write(BENCH_ENV_FILE)
+    probe = f"import sys, posterfy; print(','.join(m for m in {HEAVY_MODULES!r} if m in sys.modules))"
+    durations = []
+    for i in range(iterations + 1):
+        result = subprocess.run([sys.executable, "-X", "importtime", "-c", probe], cwd=import_dir,
+                                capture_output=True, text=True, check=True)
+        # The last importtime line is posterfy itself: "import time: self | cumulative | posterfy"
+        line = [line for line in result.stderr.splitlines() if line.rstrip().endswith("| posterfy")][-1]
+        if i:  # The first run only writes the bytecode cache
+            durations.append(int(line.split("|")[1]) / 1_000_000)
+    return {"import": summarize(durations), "heavy_modules": [m for m in result.stdout.strip().split(",") if m]}
+
+# Function to summarize a list of durations (seconds) in milliseconds
+def summarize(durations):
+    ordered = sorted(durations)
+    p95_index = min(len(ordered) - 1, int(round(0.95 * (len(ordered) - 1))))
+    return {
+        "mean_ms": statistics.mean(ordered) * 1000,
+        "p50_ms": statistics.median(ordered) * 1000,
+        "p95_ms": ordered[p95_index] * 1000,
+        "count": len(ordered),
+    }
+
+# Function to render every fixture several times with a cold cache and collect per-stage latency
+def bench_stages(posterfy, fixtures, iterations, work_dir):
+    results = {}
+    timings = {}
+    install_stage_timers(posterfy, timings)
+    for album in fixtures.values():
+        timings.clear()
+        album_url = f"https://open.spotify.com/album/{album['id']}"
+        for i in range(iterations):
+            # A fresh cache directory per iteration so every stage does its real work
+            posterfy.CACHE_DIR = tempfile.mkdtemp(dir=work_dir)
+            start = time.perf_counter()
+            with contextlib.redirect_stdout(open(os.devnull, "w")):
+                album_details = posterfy.get_album_details(album_url)
+                pdf_file = posterfy.generate_pdf(album_details, output_dir=work_dir)
+            timings.setdefault("total", []).append(time.perf_counter() - start)
+            if not pdf_file:
+                raise RuntimeError(f"Rendering fixture {album['fixture_name']} failed")
+        results[album["fixture_name"]] = {label: summarize(durations) for label, durations in timings.items()}
+    return results
+
+# Function to measure batch throughput over many distinct album IDs
+def bench_batch(posterfy, fixtures, album_count, workers, work_dir):
+    album_ids = [album["id"] for album in fixtures.values()]
+    album_urls = [f"https://open.spotify.com/album/{alias_album_id(album_ids[i % len(album_ids)], i)}"
+                  for i in range(album_count)]
+    posterfy.CACHE_DIR = tempfile.mkdtemp(dir=work_dir)
+    output_dir = tempfile.mkdtemp(dir=work_dir)
+
+    previous_dir = os.getcwd()
+    os.chdir(output_dir)
+    try:
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(open(os.devnull, "w")):
+            summary = posterfy.run_batch(iter(album_urls), workers)
+        elapsed = time.perf_counter() - start
+    finally:
+        os.chdir(previous_dir)
+
+    return {
+        "albums": album_count,
+        "workers": workers or os.cpu_count(),
+        "failed": summary["failed"],
+        "seconds": elapsed,
+        "albums_per_second": album_count / elapsed,
+    }
+
+def print_report(results):
+    startup = results.get("startup")
+    if startup:
+        print(f"import posterfy: p50 {startup['import']['p50_ms']:.1f} ms, "
+              f"heavy modules loaded: {', '.join(startup['heavy_modules']) or 'none'}")
+    print(f"{'fixture':<12} {'stage':<22} {'mean ms':>9} {'p50 ms':>9} {'p95 ms':>9}")
+    for fixture_name, stages in results["stages"].items():
+        for label in [label for label, _ in STAGES] + ["save", "total"]:
+            if label in stages:
+                stats = stages[label]
+                print(f"{fixture_name:<12} {label:<22} {stats['mean_ms']:>9.1f} {stats['p50_ms']:>9.1f} {stats['p95_ms']:>9.1f}")
+    batch = results.get("batch")
+    if batch:
+        print(f"batch: {batch['albums']} albums on {batch['workers']} workers in {batch['seconds']:.2f}s "
+              f"({batch['albums_per_second']:.1f} albums/s, {batch['failed']} failed)")
+
+# Function to list p50 latencies and batch throughput that got worse than the baseline by more than max_regression
+def find_regressions(results, baseline, max_regression):
+    regressions = []
+    for fixture_name, stages in results["stages"].items():
+        for label, stats in stages.items():
+            previous = baseline.get("stages", {}).get(fixture_name, {}).get(label)
+            # Ignore sub-millisecond noise
+            if previous and stats["p50_ms"] > previous["p50_ms"] * (1 + max_regression) + 1:
+                regressions.append(f"{fixture_name}/{label}: p50 {previous['p50_ms']:.1f}ms -> {stats['p50_ms']:.1f}ms")
+    batch, previous = results.get("batch"), baseline.get("batch")
+    if batch and batch["failed"]:
+        regressions.append(f"batch: {batch['failed']} of {batch['albums']} albums failed")
+    if batch and previous and batch["albums_per_second"] < previous["albums_per_second"] * (1 - max_regression):
+        regressions.append(f"batch: {previous['albums_per_second']:.1f} -> {batch['albums_per_second']:.1f} albums/s")
+    return regressions
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark Posterify against a local stand-in for Spotify and its CDNs.")
+    parser.add_argument("--iterations", type=int, default=5, help="renders per fixture (default: 5)")
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="simulated network latency per request")
+    parser.add_argument("--failure-rate", type=float, default=0.0,
+                        help="fraction of stub GETs answered with a 503, to measure retry overhead")
+    parser.add_argument("--batch-albums", type=int, default=40, help="albums in the batch throughput run (0 to skip)")
+    parser.add_argument("--workers", type=int, default=None, help="batch worker processes (default: CPU count)")
+    parser.add_argument("--json", metavar="FILE", help="write the results to FILE")
+    parser.add_argument("--compare", metavar="FILE", help="fail if results regressed against a previous --json FILE")
+    parser.add_argument("--import-budget-ms", type=float, default=50.0,
+                        help="fail if importing posterfy takes longer than this (p50) or loads a heavy dependency")
+    parser.add_argument("--max-regression", type=float, default=0.25,
+                        help="allowed slowdown against --compare before failing (default: 0.25 = 25%%)")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    server = start_stub_server(latency=args.latency_ms / 1000, failure_rate=args.failure_rate)
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        # Point posterfy at the stub before importing it, so pool workers started later see the same settings
+        os.environ.update(server.posterfy_environment())
+        os.environ["POSTERFY_CACHE_DIR"] = work_dir
+        sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+        import posterfy
+
+        results = {"startup": bench_import(args.iterations, work_dir)}
+        results["stages"] = bench_stages(posterfy, server.fixtures, args.iterations, work_dir)
+        if args.batch_albums:
+            results["batch"] = bench_batch(posterfy, server.fixtures, args.batch_albums, args.workers, work_dir)
+
+    server.shutdown()
+    print_report(results)
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        print(f"Results written to {args.json}")
+
+    status = 0
+    startup = results["startup"]
+    if startup["import"]["p50_ms"] > args.import_budget_ms or startup["heavy_modules"]:
+        print(f"IMPORT BUDGET exceeded: {startup['import']['p50_ms']:.1f} ms (budget {args.import_budget_ms:.0f} ms), "
+              f"heavy modules: {', '.join(startup['heavy_modules']) or 'none'}")
+        status = 1
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            regressions = find_regressions(results, json.load(f), args.max_regression)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            status = 1
+    return status
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,230 @@
+import os
+import sys
+import json
+import glob
+import time
+import zlib
+import random
+import argparse
+import threading
+import urllib.parse
+from io import BytesIO
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from PIL import Image
+
+# Stand-in for the three services Posterify talks to:
+#   POST /api/token                           Spotify accounts (client credentials)
+#   GET  /v1/albums/<id>, /v1/albums?ids=...  Spotify Web API, served from fixtures/*.json
+#   GET  /v1/albums/<id>/tracks               track paging for long albums
+#   GET  /v1/artists/<id>/albums              any artist: ARTIST_ALBUM_COUNT aliases of the fixtures
+#   GET  /v1/playlists/<id>/items             any playlist: PLAYLIST_LENGTH tracks from PLAYLIST_ALBUM_COUNT albums
+#   GET  /cdn/<id>-<size>.jpg                 cover art CDN
+#   GET  /uri/plain/png/...                   scannables.scdn.co Spotify codes
+# With a failure rate set, that fraction of GETs is answered with a 503 instead
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+TRACKS_PAGE_SIZE = 50  # Same first-page size as the real API
+ALIAS_PREFIX_LENGTH = 16  # See alias_album_id
+ARTIST_ALBUM_COUNT = 120
+PLAYLIST_LENGTH = 150  # Every album appears several times, plus one removed (null) track
+PLAYLIST_ALBUM_COUNT = 30
+
+# Function to derive the n-th distinct album ID that still resolves to the given fixture
+# (spotipy rejects anything but 22-character base62 IDs, so the suffix is replaced with digits)
+def alias_album_id(album_id, n):
+    return album_id[:ALIAS_PREFIX_LENGTH] + f"{n:06d}"
+
+# Function to load every album fixture, keyed by album ID
+def load_fixtures(fixtures_dir=FIXTURES_DIR):
+    fixtures = {}
+    for path in sorted(glob.glob(os.path.join(fixtures_dir, "*.json"))):
+        with open(path, encoding="utf-8") as f:
+            album = json.load(f)
+        album["fixture_name"] = os.path.splitext(os.path.basename(path))[0]
+        fixtures[album["id"]] = album
+    return fixtures
+
+# Function to generate a solid-color image for the fake CDNs (color derived from the name)
+def make_image(name, size, image_format):
+    color = zlib.crc32(name.encode("utf-8")) & 0xFFFFFF
+    img = Image.new("RGB", size, ((color >> 16) & 255, (color >> 8) & 255, color & 255))
+    buffer = BytesIO()
+    if image_format == "JPEG":
+        img.save(buffer, format="JPEG", quality=90)
+    else:
+        img.save(buffer, format=image_format)
+    return buffer.getvalue()
+
+class StubRequestHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        self.pause()
+        if self.path.startswith("/api/token"):
+            self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            self.send_json({"access_token": "stub-token", "token_type": "Bearer", "expires_in": 3600})
+        else:
+            self.send_error(404)
+
+    def do_GET(self):
+        self.pause()
+        # Simulate an overloaded upstream so the client's retry and backoff paths get exercised
+        if self.server.failure_rate and random.random() < self.server.failure_rate:
+            self.send_json({"error": {"status": 503, "message": "Service unavailable"}}, status=503)
+            return
+        request = urllib.parse.urlsplit(self.path)
+        query = urllib.parse.parse_qs(request.query)
+        parts = [part for part in request.path.split("/") if part]
+
+        if parts[:2] == ["v1", "albums"] and len(parts) == 2:
+            album_ids = query.get("ids", [""])[0].split(",")
+            self.send_json({"albums": [self.album_json(album_id) for album_id in album_ids]})
+        elif parts[:2] == ["v1", "albums"] and len(parts) == 3:
+            album = self.album_json(parts[2])
+            if album is None:
+                self.send_json({"error": {"status": 404, "message": "Non existing id"}}, status=404)
+            else:
+                self.send_json(album)
+        elif parts[:2] == ["v1", "albums"] and len(parts) == 4 and parts[3] == "tracks":
+            album = self.find_album(parts[2])
+            if album is None:
+                self.send_json({"error": {"status": 404, "message": "Non existing id"}}, status=404)
+                return
+            offset = int(query.get("offset", ["0"])[0])
+            limit = int(query.get("limit", [str(TRACKS_PAGE_SIZE)])[0])
+            self.send_json(self.tracks_page(parts[2], album, offset, limit))
+        elif parts[:2] == ["v1", "artists"] and len(parts) == 4 and parts[3] == "albums":
+            album_ids = [self.fixture_alias(i) for i in range(ARTIST_ALBUM_COUNT)]
+            items = [{"id": album_id, "name": f"Album {album_id}"} for album_id in album_ids]
+            self.send_json(self.listing_page(f"/v1/artists/{parts[2]}/albums", items, query, 50))
+        elif parts[:2] == ["v1", "playlists"] and len(parts) == 4 and parts[3] == "items":
+            items = [{"track": {"type": "track", "album": {"id": self.fixture_alias(i % PLAYLIST_ALBUM_COUNT)}}}
+                     for i in range(PLAYLIST_LENGTH)]
+            items[1] = {"track": None}
+            self.send_json(self.listing_page(f"/v1/playlists/{parts[2]}/items", items, query, 100))
+        elif parts[:1] == ["cdn"] and len(parts) == 2:
+            name = parts[1].rsplit(".", 1)[0]
+            size = int(name.rsplit("-", 1)[-1])
+            self.send_bytes(self.server.image(name, (size, size), "JPEG"), "image/jpeg")
+        elif parts[:3] == ["uri", "plain", "png"]:
+            self.send_bytes(self.server.image(parts[-1], (640, 160), "PNG"), "image/png")
+        else:
+            self.send_error(404)
+
+    # IDs sharing a fixture's first ALIAS_PREFIX_LENGTH characters resolve to that fixture,
+    # so batch runs can use many distinct (but still valid-looking) album IDs
+    def find_album(self, album_id):
+        return self.server.fixtures_by_prefix.get(album_id[:ALIAS_PREFIX_LENGTH])
+
+    def album_json(self, album_id):
+        album = self.find_album(album_id)
+        if album is None:
+            return None
+        album = dict(album, id=album_id)
+        album["images"] = [dict(image, url=f"{self.server.base_url}/cdn/{album_id}-{image['width']}.jpg")
+                           for image in album["images"]]
+        album["tracks"] = self.tracks_page(album_id, self.find_album(album_id), 0, TRACKS_PAGE_SIZE)
+        return album
+
+    # The n-th distinct album ID, cycling through the fixtures
+    def fixture_alias(self, n):
+        album_ids = list(self.server.fixtures)
+        return alias_album_id(album_ids[n % len(album_ids)], n)
+
+    def tracks_page(self, album_id, album, offset, limit):
+        return self.paged(f"/v1/albums/{album_id}/tracks", album["tracks"]["items"], offset, limit)
+
+    def listing_page(self, path, items, query, default_limit):
+        offset = int(query.get("offset", ["0"])[0])
+        limit = int(query.get("limit", [str(default_limit)])[0])
+        return self.paged(path, items, offset, limit)
+
+    # Function to build one page of a Spotify paging object
+    def paged(self, path, items, offset, limit):
+        next_offset = offset + limit
+        return {
+            "items": items[offset:next_offset],
+            "limit": limit,
+            "offset": offset,
+            "total": len(items),
+            "next": (f"{self.server.base_url}{path}?offset={next_offset}&limit={limit}"
+                     if next_offset < len(items) else None),
+        }
+
+    # Function to simulate network round-trip time
+    def pause(self):
+        if self.server.latency:
+            time.sleep(self.server.latency)
+
+    def send_json(self, data, status=200):
+        self.send_bytes(json.dumps(data).encode("utf-8"), "application/json", status)
+
+    def send_bytes(self, body, content_type, status=200):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # Keep benchmark output readable
+
+class StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, fixtures, latency=0.0, failure_rate=0.0):
+        super().__init__(address, StubRequestHandler)
+        self.failure_rate = failure_rate
+        self.fixtures = fixtures
+        self.fixtures_by_prefix = {album_id[:ALIAS_PREFIX_LENGTH]: album for album_id, album in fixtures.items()}
+        self.latency = latency
+        self.base_url = f"http://{self.server_address[0]}:{self.server_address[1]}"
+        self.images = {}
+        self.images_lock = threading.Lock()
+
+    # Function to return a generated image, building each one only once
+    def image(self, name, size, image_format):
+        key = (name, size, image_format)
+        with self.images_lock:
+            if key not in self.images:
+                self.images[key] = make_image(name, size, image_format)
+            return self.images[key]
+
+    # Function to return the environment variables that point Posterify at this server
+    def posterfy_environment(self):
+        return {
+            "SPOTIFY_CLIENT_ID": "stub-client",
+            "SPOTIFY_CLIENT_SECRET": "stub-secret",
+            "SPOTIFY_API_URL": f"{self.base_url}/v1/",
+            "SPOTIFY_TOKEN_URL": f"{self.base_url}/api/token",
+            "SPOTIFY_CODE_URL": self.base_url,
+        }
+
+# Function to start the stub server on a background thread
+def start_stub_server(host="127.0.0.1", port=0, latency=0.0, fixtures_dir=FIXTURES_DIR, failure_rate=0.0):
+    server = StubServer((host, port), load_fixtures(fixtures_dir), latency, failure_rate)
+    threading.Thread(target=server.serve_forever, name="stub-server", daemon=True).start()
+    return server
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve stand-in Spotify, cover CDN and Spotify code endpoints.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="delay added to every response")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="fraction of GETs answered with a 503")
+    args = parser.parse_args(argv)
+
+    server = StubServer((args.host, args.port), load_fixtures(), args.latency_ms / 1000, args.failure_rate)
+    print(f"Stub server listening on {server.base_url} with {len(server.fixtures)} fixtures")
+    print("Point Posterify at it with:")
+    for name, value in server.posterfy_environment().items():
+        print(f"  {name}={value}")
+    for album in server.fixtures.values():
+        print(f"  {album['fixture_name']}: https://open.spotify.com/album/{album['id']}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,592 +1,2542 @@
-import spotipy
-from spotipy.oauth2 import SpotifyClientCredentials
-import requests
-from PIL import Image
 from io import BytesIO
 import os
-import tempfile
+import sys
+import argparse
+import atexit
+import collections
+import contextlib
+import bisect
+import functools
+import math
+import hashlib
+import itertools
+import json
+import random
+import time
 import traceback
-from reportlab.lib.pagesizes import A4
-from reportlab.pdfgen import canvas
-from reportlab.lib.colors import black, HexColor
-from reportlab.pdfbase import pdfmetrics
-from reportlab.pdfbase.ttfonts import TTFont
-from dotenv import load_dotenv
 import re
-from textwrap import wrap
-import qrcode
+import signal
+import string
+import threading
+import urllib.parse
 
-load_dotenv()
+# Heavy dependencies (spotipy, requests, Pillow, ReportLab, qrcode, concurrent.futures)
+# are imported inside the functions that use them, so commands that never render, such as
+# --cache-info and --validate, start without loading them. benchmarks/bench.py checks the budget
+
+# A4 in points, as ReportLab defines it (kept here so importing posterfy does not load ReportLab)
+A4 = (210 * (72 / 2.54 * 0.1), 297 * (72 / 2.54 * 0.1))
+
+# Function to read KEY=VALUE settings from a .env file into the environment; variables that are
+# already set win, as with python-dotenv. Blank lines, # comments and an "export " prefix are skipped
+# and values may be quoted; it is parsed here because importing python-dotenv alone costs ~50 ms
+def read_env_file(env_path):
+    with open(env_path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if line.startswith("export "):
+                line = line[len("export "):].lstrip()
+            key, separator, value = (part.strip() for part in line.partition("="))
+            if not separator or not key or key.startswith("#"):
+                continue
+            if len(value) >= 2 and value[0] == value[-1] and value[0] in "\"'":
+                value = value[1:-1]
+            else:
+                value = value.split(" #", 1)[0].rstrip()  # Unquoted values can end in a comment
+            os.environ.setdefault(key, value)
+
+# Function to load the nearest .env file, searching up from this script's directory like python-dotenv does
+def load_env_file():
+    directory = os.path.dirname(os.path.abspath(__file__))
+    while True:
+        env_path = os.path.join(directory, ".env")
+        if os.path.isfile(env_path):
+            read_env_file(env_path)
+            return
+        parent = os.path.dirname(directory)
+        if parent == directory:
+            return
+        directory = parent
+
+load_env_file()
 
 # Set up Spotify API credentials
 SPOTIFY_CLIENT_ID = os.getenv("SPOTIFY_CLIENT_ID")
 SPOTIFY_CLIENT_SECRET = os.getenv("SPOTIFY_CLIENT_SECRET")
 
+# Service endpoints; only changed to point Posterify at a stand-in server (see benchmarks/)
+SPOTIFY_API_URL = os.getenv("SPOTIFY_API_URL", "https://api.spotify.com/v1/")
+SPOTIFY_TOKEN_URL = os.getenv("SPOTIFY_TOKEN_URL", "https://accounts.spotify.com/api/token")
+SPOTIFY_CODE_URL = os.getenv("SPOTIFY_CODE_URL", "https://scannables.scdn.co")
+
+# Thread pool for overlapping the cover and Spotify code downloads, created on first use
+_asset_executor = None
+
+# Local cache settings (override in .env)
+CACHE_DIR = os.getenv("POSTERFY_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "posterfy"))
+METADATA_CACHE_TTL = int(os.getenv("POSTERFY_METADATA_TTL", 30 * 24 * 60 * 60))  # Seconds before a cached album is refetched
+METADATA_CACHE_MAX_ENTRIES = int(os.getenv("POSTERFY_METADATA_CACHE_SIZE", 20000))  # Oldest entries are evicted beyond this
+OFFLINE_MODE = os.getenv("POSTERFY_OFFLINE", "0") == "1"  # Serve album details from the cache only, never call the API
+FONT_SEARCH_PATHS = [path for path in os.getenv("POSTERFY_FONT_PATHS", "").split(os.pathsep) if path]  # Extra font directories
+ASSET_CACHE_MAX_BYTES = int(os.getenv("POSTERFY_ASSET_CACHE_BYTES", 512 * 1024 * 1024))  # Least recently used assets are evicted beyond this
+
+# Output profiles: how the cover is prepared and how the PDF is encoded
+#   cover_dpi         resolution the cover is prepared for on the printed page
+#   cover_quality     JPEG quality of a resized cover; None re-encodes losslessly (PNG) instead
+#   page_compression  Flate-compress page content streams (None: ReportLab's default)
+#   ascii85           wrap binary streams in ASCII85 text, about 25% larger (ReportLab's default)
+#   grayscale_code    embed the black-on-off-white Spotify code with one channel instead of three
+OUTPUT_PROFILES = {
+    # The long-standing output: ReportLab's defaults and a lossless 72 DPI cover
+    "standard": {"cover_dpi": 72, "cover_quality": None, "page_compression": None, "ascii85": True,
+                 "grayscale_code": False},
+    # Full resolution (Spotify's largest cover is used as-is), nothing compressed lossily
+    "print": {"cover_dpi": 300, "cover_quality": None, "page_compression": 1, "ascii85": False,
+              "grayscale_code": False},
+    # Small files for screens: reduced DPI and a lower-quality JPEG cover
+    "web": {"cover_dpi": 60, "cover_quality": 70, "page_compression": 1, "ascii85": False,
+            "grayscale_code": True},
+}
+OUTPUT_PROFILE = os.getenv("POSTERFY_PROFILE", "standard")
+
+# Album cover settings (override in .env)
+COVER_DPI = float(os.getenv("POSTERFY_COVER_DPI", 0))  # Overrides the output profile's cover resolution when set
+COVER_PIXELS = int(os.getenv("POSTERFY_COVER_PIXELS", 0))  # Exact cover size in pixels; overrides COVER_DPI when set
+COVER_QUALITY = int(os.getenv("POSTERFY_COVER_QUALITY", 0))  # JPEG quality (1-95) of a resized cover; overrides the output profile's when set
+COVER_RESIZE_FILTERS = ("nearest", "box", "bilinear", "hamming", "bicubic", "lanczos")  # Pillow's resampling filters
+COVER_RESIZE_FILTER = os.getenv("POSTERFY_COVER_FILTER", "bicubic").lower()  # One of COVER_RESIZE_FILTERS
+
+# Instrumentation settings (override in .env)
+QUIET_MODE = os.getenv("POSTERFY_QUIET", "0") == "1"  # Drop diagnostic output, keep only results and errors the user must see
+METRICS_SINK = os.getenv("POSTERFY_METRICS", "none")  # none, jsonl:<path> (- for stderr) or prometheus[:<port>]
+
+# Function to parse "host=rate,host=rate" into {host: requests per second}, plus the entries that are not
+# valid; those are reported by main() rather than raised here, where they would break importing posterfy
+def parse_rate_limits(value):
+    limits, invalid = {}, []
+    for item in value.split(","):
+        item = item.strip()
+        if not item:
+            continue
+        host, _, rate = (part.strip() for part in item.partition("="))
+        try:
+            rate = float(rate)
+        except ValueError:
+            rate = -1  # Not a number, or no "=" at all
+        if host and rate >= 0:
+            limits[host] = rate
+        else:
+            invalid.append(item)
+    return limits, invalid
+
+# Outgoing HTTP scheduling, applied per host (override in .env)
+# Batch and service mode split the rates and burst evenly over the worker processes
+HTTP_MAX_CONCURRENCY_PER_HOST = int(os.getenv("POSTERFY_HTTP_CONCURRENCY", 8))  # Requests in flight per host
+# Token bucket refill in requests per second, as host=rate pairs; hosts not listed (the image CDNs) are not rate limited
+HTTP_RATE_LIMITS, INVALID_HTTP_RATE_LIMITS = parse_rate_limits(os.getenv("POSTERFY_HTTP_RATE_LIMITS", "api.spotify.com=10"))
+HTTP_BURST = float(os.getenv("POSTERFY_HTTP_BURST", 20))  # Token bucket size
+HTTP_MAX_RETRIES = int(os.getenv("POSTERFY_HTTP_RETRIES", 5))  # Retries after a 429, a 5xx or a connection error
+HTTP_MAX_RETRY_WAIT = float(os.getenv("POSTERFY_HTTP_MAX_WAIT", 60))  # Longer Retry-After values fail the request instead
+HTTP_BACKOFF_BASE = 0.5  # Seconds; the backoff ceiling doubles with every attempt
+HTTP_TIMEOUT = 10  # Seconds per attempt
+HTTP_RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+# Album IDs per request accepted by Spotify's "Get Several Albums" endpoint
+SPOTIFY_ALBUMS_BATCH_SIZE = 20
+# Maximum tracks per page on Spotify's "Get Album Tracks" endpoint
+SPOTIFY_TRACKS_PAGE_SIZE = 50
+# Maximum albums per page on "Get Artist's Albums", and items per page on "Get Playlist Items"
+SPOTIFY_ARTIST_ALBUMS_PAGE_SIZE = 50
+SPOTIFY_PLAYLIST_PAGE_SIZE = 100
+# Releases an artist link expands to: any of album, single, compilation and appears_on
+ARTIST_ALBUM_GROUPS = os.getenv("POSTERFY_ARTIST_ALBUM_GROUPS", "album,single,compilation")
+
+# Seconds a service request waits for its poster before giving up
+SERVICE_RENDER_TIMEOUT = 60
+
+# Albums whose assets are downloaded ahead of the page being drawn in catalog mode
+CATALOG_PREFETCH = 8
+
+# Times a batch album is submitted when worker processes die under it; a dead worker breaks the whole
+# pool, so the albums in flight are retried one at a time on a fresh one and only the culprit fails
+BATCH_RENDER_ATTEMPTS = 2
+
+# Preview images: default and maximum width in pixels, and the formats they can be written in as
+# (Pillow format, content type, encoder options); the options favour encoding speed over the last few percent of size
+PREVIEW_WIDTH = int(os.getenv("POSTERFY_PREVIEW_WIDTH", 600))
+PREVIEW_MAX_WIDTH = 4000
+PREVIEW_FORMATS = {
+    "png": ("PNG", "image/png", {"compress_level": 3}),
+    "webp": ("WEBP", "image/webp", {"quality": 80, "method": 2}),
+}
+
+# Long-lived Spotify client, created on first use (one per process)
+_spotify_client = None
+
+# HTTP session shared by the Spotify client and the image downloads, created on first use
+_http_session = None
+
+# Per-host scheduling state: concurrency slots, token bucket and Retry-After pause
+_host_limiters = {}
+_host_limiters_lock = threading.Lock()
+
+# Where finished spans are sent; None disables instrumentation entirely
+_metrics_sink = None
+
+# Function to print a diagnostic message unless quiet mode is on
+def log(message):
+    if not QUIET_MODE:
+        print(message)
+
+# Function to print the traceback of the exception being handled unless quiet mode is on
+def log_traceback():
+    if not QUIET_MODE:
+        print(traceback.format_exc())
+
+# Function to time a block of work as a named span and hand it to the metrics sink
+# Yields a dict the block can add attributes to (e.g. whether a cache was hit)
+@contextlib.contextmanager
+def span(name, **attributes):
+    sink = _metrics_sink
+    if sink is None:
+        yield attributes
+        return
+    start = time.perf_counter()
+    try:
+        yield attributes
+    except Exception:
+        attributes["error"] = True
+        raise
+    finally:
+        event = {"span": name, "duration_ms": round((time.perf_counter() - start) * 1000, 3),
+                 "timestamp": time.time(), "pid": os.getpid()}
+        event.update(attributes)
+        sink(event)
+
+# Decorator to record every call of a function as a span
+def traced(name):
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if _metrics_sink is None:
+                return func(*args, **kwargs)
+            with span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+# Function to build a sink that appends one JSON object per span to a file ("-" for stderr)
+# The file is closed when the interpreter exits
+def make_jsonl_sink(path):
+    if path == "-":
+        stream = sys.stderr
+    else:
+        stream = open(path, "a", encoding="utf-8")
+        atexit.register(stream.close)
+    lock = threading.Lock()
+    def sink(event):
+        line = json.dumps(event) + "\n"
+        with lock:
+            stream.write(line)
+            stream.flush()
+    return sink
+
+# Histogram buckets (milliseconds) for the Prometheus-style sink
+PROMETHEUS_BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000)
+
+# Per-span aggregates kept by the Prometheus-style sink
+_prometheus_stats = {}
+_prometheus_lock = threading.Lock()
+
+# Function to fold a span into the per-span duration histograms
+def record_prometheus_span(event):
+    with _prometheus_lock:
+        stats = _prometheus_stats.get(event["span"])
+        if stats is None:
+            stats = _prometheus_stats[event["span"]] = {"count": 0, "sum": 0.0, "errors": 0,
+                                                         "buckets": [0] * len(PROMETHEUS_BUCKETS_MS)}
+        stats["count"] += 1
+        stats["sum"] += event["duration_ms"] / 1000
+        if event.get("error"):
+            stats["errors"] += 1
+        for i, bound in enumerate(PROMETHEUS_BUCKETS_MS):
+            if event["duration_ms"] <= bound:
+                stats["buckets"][i] += 1
+
+# Function to render the span histograms in the Prometheus text exposition format
+def render_prometheus_metrics():
+    lines = ["# HELP posterfy_span_duration_seconds Time spent in each render stage",
+             "# TYPE posterfy_span_duration_seconds histogram"]
+    with _prometheus_lock:
+        for name, stats in sorted(_prometheus_stats.items()):
+            for bound, count in zip(PROMETHEUS_BUCKETS_MS, stats["buckets"]):
+                lines.append(f'posterfy_span_duration_seconds_bucket{{span="{name}",le="{bound / 1000:g}"}} {count}')
+            lines.append(f'posterfy_span_duration_seconds_bucket{{span="{name}",le="+Inf"}} {stats["count"]}')
+            lines.append(f'posterfy_span_duration_seconds_sum{{span="{name}"}} {stats["sum"]:.6f}')
+            lines.append(f'posterfy_span_duration_seconds_count{{span="{name}"}} {stats["count"]}')
+        lines.append("# HELP posterfy_span_errors_total Spans that ended in an exception")
+        lines.append("# TYPE posterfy_span_errors_total counter")
+        for name, stats in sorted(_prometheus_stats.items()):
+            lines.append(f'posterfy_span_errors_total{{span="{name}"}} {stats["errors"]}')
+    return "\n".join(lines) + "\n"
+
+# Spans recorded inside a pool worker, shipped back to the parent with the render result
+_span_buffer = []
+
+# Function to return and clear the spans a worker recorded for the current render
+def drain_span_events():
+    events = _span_buffer[:]
+    del _span_buffer[:len(events)]
+    return events
+
+# Function to pass spans recorded elsewhere (e.g. in a pool worker) to this process's sink
+def emit_span_events(events):
+    if _metrics_sink is not None:
+        for event in events:
+            _metrics_sink(event)
+
+# Function to check a metrics sink spec without opening anything; returns None if valid, else the reason
+def metrics_sink_error(spec):
+    kind, _, option = (spec or "none").partition(":")
+    if kind not in ("none", "jsonl", "prometheus"):
+        return f"Unknown metrics sink {spec!r}; use none, jsonl:<path> (- for stderr) or prometheus[:<port>]"
+    if kind == "prometheus" and option and not (option.isdigit() and 0 < int(option) < 65536):
+        return f"Invalid metrics port {option!r}; expected a number from 1 to 65535"
+    return None
+
+# Function to pick the metrics sink from a spec: none, jsonl:<path> or prometheus[:<port>]
+# A Prometheus port starts a small /metrics endpoint; the rendering service always exposes one
+def configure_metrics(spec):
+    global _metrics_sink
+    kind, _, option = (spec or "none").partition(":")
+    if kind == "none":
+        _metrics_sink = None
+    elif kind == "jsonl":
+        _metrics_sink = make_jsonl_sink(option or "-")
+    elif kind == "prometheus":
+        _metrics_sink = record_prometheus_span
+        if option:
+            start_metrics_server(int(option))
+    else:
+        raise ValueError(f"Unknown metrics sink: {spec}")
+
+# Function to return the scheduling state of a host, creating it on first use
+def get_host_limiter(host):
+    with _host_limiters_lock:
+        limiter = _host_limiters.get(host)
+        if limiter is None:
+            limiter = _host_limiters[host] = {
+                "slots": threading.BoundedSemaphore(HTTP_MAX_CONCURRENCY_PER_HOST),
+                "lock": threading.Lock(),
+                "rate": HTTP_RATE_LIMITS.get(host, 0),
+                "tokens": HTTP_BURST,
+                "updated": time.monotonic(),
+                "paused_until": 0.0,
+            }
+        return limiter
+
+# Function to block until the host accepts another request: waits out any Retry-After pause,
+# then takes a token from the bucket (refilled at the host's HTTP_RATE_LIMITS rate)
+def wait_for_request_token(limiter):
+    while True:
+        with limiter["lock"]:
+            now = time.monotonic()
+            rate = limiter["rate"]
+            if rate > 0:
+                limiter["tokens"] = min(HTTP_BURST, limiter["tokens"] + (now - limiter["updated"]) * rate)
+            limiter["updated"] = now
+            if now >= limiter["paused_until"]:
+                if rate <= 0:
+                    return
+                if limiter["tokens"] >= 1:
+                    limiter["tokens"] -= 1
+                    return
+            delay = max(limiter["paused_until"] - now, (1 - limiter["tokens"]) / rate if rate > 0 else 0)
+        time.sleep(delay)
+
+# Function to read a Retry-After header (seconds or an HTTP date) as seconds, or None
+def retry_after_seconds(response):
+    value = response.headers.get("Retry-After")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        from email.utils import parsedate_to_datetime
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+# Function to send a request through the per-host scheduler, retrying rate limits and transient failures
+# A Retry-After on a 429/503 pauses every request to that host; other retries use full-jitter
+# exponential backoff. When the retries run out, the last response is returned (or the error raised)
+def send_scheduled(send, request, **kwargs):
+    import requests
+    host = urllib.parse.urlsplit(request.url).netloc
+    limiter = get_host_limiter(host)
+    with span("http_request", host=host) as attributes:
+        queued_seconds = 0.0
+        for attempt in range(HTTP_MAX_RETRIES + 1):
+            response = None
+            queued = time.perf_counter()
+            with limiter["slots"]:
+                wait_for_request_token(limiter)
+                queued_seconds += time.perf_counter() - queued
+                try:
+                    response = send(request, **kwargs)
+                except (requests.ConnectionError, requests.Timeout) as e:
+                    if attempt == HTTP_MAX_RETRIES:
+                        raise
+                    problem = type(e).__name__
+
+            attributes.update(attempts=attempt + 1, queued_ms=round(queued_seconds * 1000, 3))
+            if response is not None:
+                attributes["status"] = response.status_code
+                if response.status_code not in HTTP_RETRY_STATUSES or attempt == HTTP_MAX_RETRIES:
+                    return response
+                problem = f"HTTP {response.status_code}"
+
+            pause = retry_after_seconds(response) if response is not None else None
+            if pause is not None and pause > HTTP_MAX_RETRY_WAIT:
+                log(f"{host} asked to wait {pause:.0f}s, more than the {HTTP_MAX_RETRY_WAIT:.0f}s allowed; giving up")
+                return response
+            if response is not None:
+                response.close()
+            if pause is not None:
+                # The next attempt (and every other request to this host) waits out the pause for its token
+                log(f"{problem} from {host}, pausing the host for {pause:.1f}s (attempt {attempt + 2} of {HTTP_MAX_RETRIES + 1})")
+                with limiter["lock"]:
+                    limiter["paused_until"] = max(limiter["paused_until"], time.monotonic() + pause)
+            else:
+                delay = random.uniform(0, HTTP_BACKOFF_BASE * 2 ** attempt)
+                log(f"{problem} from {host}, retrying in {delay:.1f}s (attempt {attempt + 2} of {HTTP_MAX_RETRIES + 1})")
+                time.sleep(delay)
+
+# Function to return the process-wide HTTP session, which sends every request through the scheduler
+def get_http_session():
+    global _http_session
+    if _http_session is None:
+        import requests
+        from requests.adapters import HTTPAdapter
+
+        class ScheduledHTTPAdapter(HTTPAdapter):
+            def send(self, request, **kwargs):
+                return send_scheduled(super().send, request, **kwargs)
+
+        session = requests.Session()
+        adapter = ScheduledHTTPAdapter(pool_maxsize=HTTP_MAX_CONCURRENCY_PER_HOST)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        _http_session = session
+    return _http_session
+
+# Function to return the process-wide Spotify client
+# The auth manager keeps the access token in memory until it expires and spotipy's
+# requests session keeps the HTTPS connection alive, so repeated lookups skip both handshakes
+def get_spotify_client():
+    global _spotify_client
+    if _spotify_client is None:
+        import spotipy
+        from spotipy.oauth2 import SpotifyClientCredentials
+        from spotipy.cache_handler import MemoryCacheHandler
+        log("Initializing Spotify client")
+        # Both share the scheduled session, which takes over spotipy's own retry handling
+        auth_manager = SpotifyClientCredentials(
+            client_id=SPOTIFY_CLIENT_ID,
+            client_secret=SPOTIFY_CLIENT_SECRET,
+            cache_handler=MemoryCacheHandler(),
+            requests_session=get_http_session()
+        )
+        auth_manager.OAUTH_TOKEN_URL = SPOTIFY_TOKEN_URL
+        _spotify_client = spotipy.Spotify(auth_manager=auth_manager, requests_session=get_http_session(),
+                                          requests_timeout=HTTP_TIMEOUT)
+        _spotify_client.prefix = SPOTIFY_API_URL
+    return _spotify_client
+
+# Function to extract the album ID from a Spotify album URL
+def extract_album_id(album_url):
+    return album_url.split("/")[-1].split("?")[0]
+
+# Shape of a Spotify album link: optional locale segment, 22-character base62 ID, optional query
+ALBUM_URL_PATTERN = re.compile(r"https?://[a-z]+\.spotify\.com/(?:intl-[a-z]{2}(?:-[a-z]{2})?/)?album/([A-Za-z0-9]{22})(?:\?.*)?")
+
+# Function to check an album URL without calling the API; returns None if valid, else the reason
+def validate_album_url(album_url):
+    if not ALBUM_URL_PATTERN.fullmatch(album_url.strip()):
+        if "spotify.com/album/" not in album_url:
+            return "not a Spotify album link"
+        return "album ID must be 22 letters and digits"
+    return None
+
+# Shape of any Spotify link batch and catalog mode accept: the kind of source and its ID
+SOURCE_URL_PATTERN = re.compile(r"https?://[a-z]+\.spotify\.com/(?:intl-[a-z]{2}(?:-[a-z]{2})?/)?"
+                                r"(album|artist|playlist)/([A-Za-z0-9]{22})(?:\?.*)?")
+
+# Function to yield every item of a paged Spotify listing
+# Each page is requested only once the previous one is being consumed, in the background,
+# so a caller that stops early never pays for the rest of the listing
+def iter_spotify_pages(fetch_page, page_size):
+    executor = get_asset_executor()
+    page = fetch_page(limit=page_size, offset=0)
+    while True:
+        upcoming = None
+        if page.get("next"):
+            upcoming = executor.submit(fetch_page, limit=page_size, offset=page["offset"] + len(page["items"]))
+        yield from page["items"]
+        if upcoming is None:
+            return
+        page = upcoming.result()
+
+# Function to yield the IDs of an artist's releases (see ARTIST_ALBUM_GROUPS), page by page
+def iter_artist_album_ids(artist_id):
+    fetch_page = functools.partial(get_spotify_client().artist_albums, artist_id, include_groups=ARTIST_ALBUM_GROUPS)
+    for album in iter_spotify_pages(fetch_page, SPOTIFY_ARTIST_ALBUMS_PAGE_SIZE):
+        yield album["id"]
+
+# Function to yield the album ID of every track on a playlist, page by page
+def iter_playlist_album_ids(playlist_id):
+    fetch_page = functools.partial(get_spotify_client().playlist_items, playlist_id, additional_types=("track",))
+    for entry in iter_spotify_pages(fetch_page, SPOTIFY_PLAYLIST_PAGE_SIZE):
+        # Removed tracks come back as null and local files have no album ID
+        track = entry.get("item") or entry.get("track") or {}
+        album_id = (track.get("album") or {}).get("id")
+        if album_id:
+            yield album_id
+
+# Source adapters: each turns the ID of a Spotify link into a stream of album IDs
+SOURCE_ADAPTERS = {"artist": iter_artist_album_ids, "playlist": iter_playlist_album_ids}
+
+# Function to turn a stream of Spotify links into a stream of album URLs to render
+# Album links pass through; artist and playlist links are listed lazily, so the first posters render
+# while later pages are still unread. Each album is yielded once however many sources list it
+# A source that cannot be listed is reported as a failure in summary
+def iter_source_album_urls(source_urls, summary):
+    seen_album_ids = set()
+    for source_url in source_urls:
+        match = SOURCE_URL_PATTERN.fullmatch(source_url.strip())
+        if match is None or match.group(1) == "album":
+            # Malformed links pass through too and fail with the album lookup's error
+            album_id = extract_album_id(source_url)
+            if album_id not in seen_album_ids:
+                seen_album_ids.add(album_id)
+                yield source_url
+            continue
+
+        kind, source_id = match.groups()
+        if OFFLINE_MODE:
+            report_batch_result({"album_url": source_url, "success": False,
+                                 "error": f"cannot list the albums of this {kind} offline"}, summary)
+            continue
+        log(f"Listing albums of {kind} {source_id}")
+        new_albums = 0
+        try:
+            for album_id in SOURCE_ADAPTERS[kind](source_id):
+                if album_id not in seen_album_ids:
+                    seen_album_ids.add(album_id)
+                    new_albums += 1
+                    yield f"https://open.spotify.com/album/{album_id}"
+        except Exception as e:
+            log(f"Error listing albums of {kind} {source_id}: {str(e)}")
+            log_traceback()
+            report_batch_result({"album_url": source_url, "success": False, "error": str(e)}, summary)
+            continue
+        log(f"Found {new_albums} new albums for {kind} {source_id}")
+
+# Function to yield every track name of an album, following Spotify's paging
+# The album object only embeds the first page of tracks; the remaining pages are requested
+# concurrently up front and yielded in order as they arrive
+def iter_album_tracks(album):
+    first_page = album["tracks"]
+    for track in first_page["items"]:
+        yield track["name"]
+    if not first_page.get("next"):
+        return
+
+    page_size = first_page.get("limit") or SPOTIFY_TRACKS_PAGE_SIZE
+    offsets = range(first_page.get("offset", 0) + len(first_page["items"]), first_page["total"], page_size)
+    log(f"Fetching {len(offsets)} more page(s) of tracks for album: {album['name']}")
+    sp = get_spotify_client()
+    executor = get_asset_executor()
+    pages = [executor.submit(sp.album_tracks, album["id"], limit=page_size, offset=offset) for offset in offsets]
+    for page in pages:
+        for track in page.result()["items"]:
+            yield track["name"]
+
+# Function to turn a Spotify album object into the details dict used for rendering
+def parse_album(album, album_url):
+    album_name = album["name"]
+    artist_name = album["artists"][0]["name"]
+    album_cover_url = album["images"][0]["url"] if album["images"] else None
+    # Every size Spotify offers, so the download can pick the smallest one that is good enough
+    album_cover_images = [{"url": image["url"], "width": image.get("width") or 0} for image in album["images"]]
+    tracks = list(iter_album_tracks(album))
+
+    log(f"Successfully fetched album: {album_name} by {artist_name}")
+    log(f"Found {len(tracks)} tracks")
+
+    return {
+        "album_name": album_name,
+        "artist_name": artist_name,
+        "album_cover_url": album_cover_url,
+        "album_cover_images": album_cover_images,
+        "tracks": tracks,
+        "album_url": album_url,
+        "success": True
+    }
+
+# Function to return the metadata cache file for an album ID
+def metadata_cache_path(album_id):
+    return os.path.join(CACHE_DIR, "metadata", re.sub(r"[^A-Za-z0-9]", "_", album_id) + ".json")
+
+# Function to load cached album details, or None on a miss
+# Expired entries count as a miss unless we are offline, where stale data beats no data
+def load_cached_album_details(album_id, album_url):
+    cache_path = metadata_cache_path(album_id)
+    try:
+        with open(cache_path, encoding="utf-8") as f:
+            entry = json.load(f)
+        # Valid JSON that is not a cache entry (truncated by hand, another tool's file) is unreadable too
+        age = time.time() - entry["cached_at"]
+        album_details = entry["album_details"]
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        log(f"Ignoring unreadable metadata cache entry {cache_path}: {str(e)}")
+        return None
+
+    if age > METADATA_CACHE_TTL and not OFFLINE_MODE:
+        log(f"Metadata cache entry for {album_id} expired ({int(age)}s old)")
+        return None
+
+    log(f"Using cached album details for: {album_id}")
+    # The same album can be reached through differently decorated URLs (e.g. ?si=...)
+    album_details["album_url"] = album_url
+    return album_details
+
+# Function to store album details in the metadata cache
+def save_album_details_to_cache(album_id, album_details):
+    cache_path = metadata_cache_path(album_id)
+    try:
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        # Write to a temporary file first so concurrent readers never see half an entry
+        temp_path = f"{cache_path}.{os.getpid()}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump({"cached_at": time.time(), "album_details": album_details}, f)
+        is_new = not os.path.exists(cache_path)
+        os.replace(temp_path, cache_path)
+        count_cache_write(os.path.dirname(cache_path), int(is_new), METADATA_CACHE_MAX_ENTRIES, prune_metadata_cache)
+    except Exception as e:
+        log(f"Error writing metadata cache entry {cache_path}: {str(e)}")
+
+# Per cache directory, the size this process believes it has (entries or bytes) and the writes since
+# it was last measured. Scanning a large cache on every write would cost more than the cache saves,
+# so a directory is only rescanned once the tracked size passes its limit, or every
+# CACHE_RESCAN_WRITES writes to catch up with what other processes added
+CACHE_RESCAN_WRITES = 1000
+# A full cache is pruned to this fraction of its limit, so the next scan is many writes away
+CACHE_PRUNE_TARGET = 0.9
+_cache_sizes = {}
+_cache_sizes_lock = threading.Lock()
+
+# Function to account for one cache write of the given size (1 for a new entry, or a byte count);
+# prune(), which evicts what is over the limit and returns the remaining size, runs only when needed
+def count_cache_write(cache_dir, size, limit, prune):
+    with _cache_sizes_lock:
+        tracked = _cache_sizes.get(cache_dir)
+        if tracked is not None and tracked["writes"] < CACHE_RESCAN_WRITES:
+            tracked["size"] += size
+            tracked["writes"] += 1
+            if tracked["size"] <= limit:
+                return
+        _cache_sizes[cache_dir] = {"size": prune(), "writes": 0}
+
+# Function to evict the least recently written entries once the cache grows past its size limit
+# Returns the number of entries left
+def prune_metadata_cache():
+    cache_dir = os.path.join(CACHE_DIR, "metadata")
+    entries = [entry for entry in os.scandir(cache_dir) if entry.name.endswith(".json")]
+    if len(entries) <= METADATA_CACHE_MAX_ENTRIES:
+        return len(entries)
+    excess = len(entries) - int(METADATA_CACHE_MAX_ENTRIES * CACHE_PRUNE_TARGET)
+
+    entries.sort(key=lambda entry: entry.stat().st_mtime)
+    for entry in entries[:excess]:
+        try:
+            os.remove(entry.path)
+        except FileNotFoundError:
+            pass  # Another process evicted it first
+    log(f"Evicted {excess} entries from the metadata cache")
+    return len(entries) - excess
+
+@traced("fetch_album")
 def get_album_details(album_url):
     try:
-        print(f"Fetching album details for: {album_url}")
+        log(f"Fetching album details for: {album_url}")
         # Extract album ID from URL
-        album_id = album_url.split("/")[-1].split("?")[0]
-        print(f"Extracted album ID: {album_id}")
-        
-        # Initialize Spotify client
-        sp = spotipy.Spotify(auth_manager=SpotifyClientCredentials(
-            client_id=SPOTIFY_CLIENT_ID,
-            client_secret=SPOTIFY_CLIENT_SECRET
-        ))
+        album_id = extract_album_id(album_url)
+        log(f"Extracted album ID: {album_id}")
+
+        album_details = load_cached_album_details(album_id, album_url)
+        if album_details is not None:
+            return album_details
+        if OFFLINE_MODE:
+            return {"success": False, "error": f"Album {album_id} is not in the cache (offline mode)"}
         
         # Get album information
-        album = sp.album(album_id)
-        album_name = album["name"]
-        artist_name = album["artists"][0]["name"]
-        album_cover_url = album["images"][0]["url"] if album["images"] else None
-        tracks = [track["name"] for track in album["tracks"]["items"]]
-        
-        print(f"Successfully fetched album: {album_name} by {artist_name}")
-        print(f"Found {len(tracks)} tracks")
-        
-        return {
-            "album_name": album_name,
-            "artist_name": artist_name,
-            "album_cover_url": album_cover_url,
-            "tracks": tracks,
-            "album_url": album_url,
-            "success": True
-        }
+        album = get_spotify_client().album(album_id)
+        album_details = parse_album(album, album_url)
+        save_album_details_to_cache(album_id, album_details)
+        return album_details
     except Exception as e:
-        print(f"Error fetching album details: {str(e)}")
-        print(traceback.format_exc())
+        log(f"Error fetching album details: {str(e)}")
+        log_traceback()
         return {"success": False, "error": str(e)}
 
-def download_album_cover(url):
+# Function to fetch details for many albums at once through the multi-album endpoint
+# Cached albums are served locally; only the misses are fetched from Spotify in chunks
+# Returns one details dict per URL, in the same order; failures are reported per album
+@traced("fetch_albums")
+def get_albums_details(album_urls):
+    album_urls = list(album_urls)
+    album_ids = [extract_album_id(album_url) for album_url in album_urls]
+    results = [load_cached_album_details(album_id, album_url) for album_id, album_url in zip(album_ids, album_urls)]
+    missing = [i for i, album_details in enumerate(results) if album_details is None]
+
+    if OFFLINE_MODE:
+        for i in missing:
+            results[i] = {"success": False, "error": f"Album {album_ids[i]} is not in the cache (offline mode)"}
+        return results
+
+    for start in range(0, len(missing), SPOTIFY_ALBUMS_BATCH_SIZE):
+        chunk = missing[start:start + SPOTIFY_ALBUMS_BATCH_SIZE]
+        try:
+            log(f"Fetching album details for {len(chunk)} albums")
+            albums = get_spotify_client().albums([album_ids[i] for i in chunk])["albums"]
+        except Exception as e:
+            log(f"Error fetching album details: {str(e)}")
+            log_traceback()
+            for i in chunk:
+                results[i] = {"success": False, "error": str(e)}
+            continue
+
+        # Spotify returns null in place of any ID it does not recognize
+        for i, album in zip(chunk, albums):
+            if album is None:
+                results[i] = {"success": False, "error": f"Album not found: {album_urls[i]}"}
+                continue
+            try:
+                results[i] = parse_album(album, album_urls[i])
+                save_album_details_to_cache(album_ids[i], results[i])
+            except Exception as e:
+                log(f"Error parsing album details: {str(e)}")
+                results[i] = {"success": False, "error": str(e)}
+    return results
+
+# Function to return the asset cache file for a cache key (e.g. a URL plus the size it was resized to)
+def asset_cache_path(key):
+    return os.path.join(CACHE_DIR, "assets", hashlib.sha256(key.encode("utf-8")).hexdigest())
+
+# Function to load a cached asset's bytes, or None on a miss
+def load_cached_asset(key):
+    cache_path = asset_cache_path(key)
     try:
-        print(f"Downloading album cover from: {url}")
-        response = requests.get(url, timeout=10)
-        response.raise_for_status()  # Raise exception for bad responses
-        img = Image.open(BytesIO(response.content))
-        img = img.resize((400, 400))  # Resize for consistency
-        print("Album cover downloaded and resized successfully")
-        return img
+        with open(cache_path, "rb") as f:
+            data = f.read()
+        # Bump the modification time so eviction treats this asset as recently used
+        os.utime(cache_path)
+        return data
+    except FileNotFoundError:
+        return None
     except Exception as e:
-        print(f"Error downloading album cover: {str(e)}")
-        print(traceback.format_exc())
+        log(f"Ignoring unreadable asset cache entry {cache_path}: {str(e)}")
+        return None
+
+# Function to store an asset's bytes in the asset cache
+def save_asset_to_cache(key, data):
+    cache_path = asset_cache_path(key)
+    try:
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        # Write to a temporary file first so concurrent readers never see a partial image
+        temp_path = f"{cache_path}.{os.getpid()}.tmp"
+        with open(temp_path, "wb") as f:
+            f.write(data)
+        try:
+            replaced_bytes = os.path.getsize(cache_path)
+        except FileNotFoundError:
+            replaced_bytes = 0
+        os.replace(temp_path, cache_path)
+        count_cache_write(os.path.dirname(cache_path), len(data) - replaced_bytes, ASSET_CACHE_MAX_BYTES,
+                          prune_asset_cache)
+    except Exception as e:
+        log(f"Error writing asset cache entry {cache_path}: {str(e)}")
+
+# Function to evict least recently used assets once the cache is over its byte budget, down to
+# CACHE_PRUNE_TARGET of it; returns the bytes left
+def prune_asset_cache():
+    cache_dir = os.path.join(CACHE_DIR, "assets")
+    entries = []
+    total_bytes = 0
+    for entry in os.scandir(cache_dir):
+        if entry.name.endswith(".tmp"):
+            continue
+        stat = entry.stat()
+        entries.append((stat.st_mtime, stat.st_size, entry.path))
+        total_bytes += stat.st_size
+    if total_bytes <= ASSET_CACHE_MAX_BYTES:
+        return total_bytes
+
+    entries.sort()
+    for _, size, path in entries:
+        if total_bytes <= ASSET_CACHE_MAX_BYTES * CACHE_PRUNE_TARGET:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass  # Another process evicted it first
+        total_bytes -= size
+    log(f"Pruned asset cache to {total_bytes} bytes")
+    return total_bytes
+
+# Function to summarize the metadata and asset caches (entry counts, sizes, expired entries)
+# A metadata entry's modification time is when it was cached, so no entry has to be parsed
+def cache_info():
+    now = time.time()
+    info = {"cache_dir": CACHE_DIR}
+    for name in ("metadata", "assets"):
+        stats = info[name] = {"entries": 0, "bytes": 0, "expired": 0}
+        try:
+            entries = list(os.scandir(os.path.join(CACHE_DIR, name)))
+        except FileNotFoundError:
+            continue
+        for entry in entries:
+            if entry.name.endswith(".tmp"):
+                continue
+            stat = entry.stat()
+            stats["entries"] += 1
+            stats["bytes"] += stat.st_size
+            if name == "metadata" and now - stat.st_mtime > METADATA_CACHE_TTL:
+                stats["expired"] += 1
+    return info
+
+# Function to return the settings of the selected output profile
+def output_profile():
+    return OUTPUT_PROFILES[OUTPUT_PROFILE]
+
+# Function to return the cover's target size in pixels: COVER_PIXELS, or COVER_SIZE points at
+# COVER_DPI (the output profile's resolution unless overridden)
+def cover_pixel_size():
+    return COVER_PIXELS or max(1, round(COVER_SIZE * (COVER_DPI or output_profile()["cover_dpi"]) / 72))
+
+# Function to return the JPEG quality of a resized cover: COVER_QUALITY, or the output profile's
+# (None when the profile stores resized covers losslessly)
+def cover_quality():
+    return COVER_QUALITY or output_profile()["cover_quality"]
+
+# Function to return the asset cache key of a cover: its source URL plus how it was resized and encoded
+def album_cover_cache_key(url, size):
+    quality = cover_quality()
+    encoding = "lossless" if quality is None else f"jpeg{quality}"
+    return f"album_cover:{size}x{size}:{COVER_RESIZE_FILTER}:{encoding}:{url}"
+
+# Function to pick the smallest cover variant that is at least the target size (the largest if none is)
+# Details cached before variants were recorded only know the largest cover
+def choose_cover_url(album_details, size):
+    images = album_details.get("album_cover_images")
+    if not images:
+        return album_details["album_cover_url"]
+    large_enough = [image for image in images if image["width"] >= size]
+    if large_enough:
+        return min(large_enough, key=lambda image: image["width"])["url"]
+    return max(images, key=lambda image: image["width"])["url"]
+
+# An image asset as both the ReportLab ImageReader the PDF embeds and the Pillow image the preview
+# pastes, so neither has to decode the image again (a JPEG the PDF embeds as-is is only opened)
+ImageAsset = collections.namedtuple("ImageAsset", ["reader", "image"])
+
+# Function to download the album cover and return it as an ImageAsset, size pixels square
+# A JPEG cover that already has the target size is kept as JPEG bytes end to end, so ReportLab embeds
+# it as-is; a resized cover is stored as PNG, or as a JPEG of cover_quality() when the profile sets one
+@traced("album_cover")
+def download_album_cover(url, size=None):
+    from PIL import Image
+    from reportlab.lib.utils import ImageReader
+    size = size or cover_pixel_size()
+    try:
+        # The cache holds the already resized cover, so a hit skips the download, decode and resize
+        cache_key = album_cover_cache_key(url, size)
+        cached = load_cached_asset(cache_key)
+        if cached is not None:
+            log(f"Using cached album cover for: {url}")
+            return ImageAsset(ImageReader(BytesIO(cached)), Image.open(BytesIO(cached)))
+
+        log(f"Downloading album cover from: {url}")
+        with span("cover_download"):
+            response = get_http_session().get(url, timeout=HTTP_TIMEOUT)
+            response.raise_for_status()  # Raise exception for bad responses
+        cover_data = response.content
+        with span("cover_resize", source_bytes=len(cover_data)):
+            img = Image.open(BytesIO(cover_data))
+            # Never upscale: a cover smaller than the target only gets squared up
+            target = min(size, *img.size)
+            if img.format != "JPEG" or img.size != (target, target):
+                # Let libjpeg decode an oversized JPEG at 1/2, 1/4 or 1/8 scale (never below the target),
+                # then reduce() by whole factors before the final filtered resize
+                img.draft("RGB", (target, target))
+                resample = getattr(Image, COVER_RESIZE_FILTER.upper())
+                img = img.convert("RGB").resize((target, target), resample=resample, reducing_gap=3.0)
+                buffer = BytesIO()
+                quality = cover_quality()
+                if quality is None:
+                    img.save(buffer, format="PNG")
+                else:
+                    img.save(buffer, format="JPEG", quality=quality)
+                cover_data = buffer.getvalue()
+        log("Album cover downloaded and resized successfully")
+
+        save_asset_to_cache(cache_key, cover_data)
+        return ImageAsset(ImageReader(BytesIO(cover_data)), img)
+    except Exception as e:
+        log(f"Error downloading album cover: {str(e)}")
+        log_traceback()
         return None
 
 def safe_filename(filename):
     # Replace invalid characters with underscore
     safe_name = re.sub(r'[\\/*?:"<>|]', "_", filename)
-    print(f"Converted filename '{filename}' to safe filename '{safe_name}'")
+    log(f"Converted filename '{filename}' to safe filename '{safe_name}'")
     return safe_name
 
-# Function to calculate required height for track list with given font size
-def calculate_tracklist_height(c, tracks, first_column_width, second_column_width, font_name, font_size):
-    line_height = font_size + 5
-    
-    # Calculate height for first column
-    first_column_tracks = min(len(tracks) // 2 + len(tracks) % 2, len(tracks))
-    first_column_height = 0
-    
-    for i in range(first_column_tracks):
-        track_name = tracks[i]
-        lines_needed = calculate_lines_needed(c, track_name, first_column_width, font_name, font_size)
-        first_column_height += lines_needed * line_height + 2  # Add 2 for small spacing between tracks
-    
-    # Calculate height for second column
-    second_column_height = 0
-    for i in range(first_column_tracks, len(tracks)):
-        track_name = tracks[i]
-        lines_needed = calculate_lines_needed(c, track_name, second_column_width, font_name, font_size)
-        second_column_height += lines_needed * line_height + 2  # Add 2 for small spacing between tracks
-    
-    # Return the taller of the two columns
-    return max(first_column_height, second_column_height)
+# Character width tables per font, measured at font size 1 and filled in lazily
+# Widths scale linearly with the font size, so one table serves every size of a font
+_char_width_tables = {}
 
-# Function to calculate how many lines a text needs when wrapped
-def calculate_lines_needed(c, text, max_width, font_name, font_size):
-    # Calculate how many characters can fit in the available width
-    text_width = c.stringWidth(text, font_name, font_size)
-    
-    if text_width <= max_width:
-        return 1  # Text fits on one line
-    else:
-        # Estimate chars per line (approximate)
-        chars_per_line = max(10, int(len(text) * (max_width / text_width)))
-        lines_needed = 0
-        remaining = text
-        
-        while remaining:
-            # Start with estimated chars per line
-            test_len = min(chars_per_line, len(remaining))
-            test_text = remaining[:test_len]
-            
-            # If this isn't the end, try to find a space to break at
-            if test_len < len(remaining) and test_len > 0:
-                # Find last space within the test text
-                last_space = test_text.rfind(' ')
-                if last_space > 0:
-                    test_len = last_space + 1  # +1 to include the space
-                    test_text = remaining[:test_len]
-            
-            # Check if this segment actually fits
-            while c.stringWidth(test_text, font_name, font_size) > max_width and test_len > 1:
-                test_len -= 1
-                test_text = remaining[:test_len]
-            
-            lines_needed += 1
-            remaining = remaining[test_len:].strip()
-        
-        return lines_needed
+# Function to return the font-size-1 width of every character in text, using the memoized table
+def get_char_widths(text, font_name):
+    table = _char_width_tables.get(font_name)
+    if table is None:
+        table = _char_width_tables[font_name] = {}
+    widths = []
+    for char in text:
+        char_width = table.get(char)
+        if char_width is None:
+            from reportlab.pdfbase import pdfmetrics
+            char_width = table[char] = pdfmetrics.stringWidth(char, font_name, 1)
+        widths.append(char_width)
+    return widths
 
-# Function to draw wrapped text and return new y position
-def draw_wrapped_text(c, text, x, y, max_width, line_height, font_name, font_size):
-    # Calculate how many characters can fit in the available width
-    text_width = c.stringWidth(text, font_name, font_size)
-    
-    if text_width <= max_width:
-        # Text fits on one line
-        c.drawString(x, y, text)
-        return y - line_height, 1, text_width  # Return new y position, line count, and text width
-    else:
-        # Text needs to be wrapped
-        # Estimate chars per line (approximate)
-        chars_per_line = max(10, int(len(text) * (max_width / text_width)))
-        
-        # Try to wrap text smartly
-        wrapped_lines = []
-        remaining = text
-        
-        while remaining:
-            # Start with estimated chars per line
-            test_len = min(chars_per_line, len(remaining))
-            test_text = remaining[:test_len]
-            
-            # If this isn't the end, try to find a space to break at
-            if test_len < len(remaining) and test_len > 0:
-                # Find last space within the test text
-                last_space = test_text.rfind(' ')
-                if last_space > 0:
-                    test_len = last_space + 1  # +1 to include the space
-                    test_text = remaining[:test_len]
-            
-            # Check if this segment actually fits
-            while c.stringWidth(test_text, font_name, font_size) > max_width and test_len > 1:
-                test_len -= 1
-                test_text = remaining[:test_len]
-            
-            wrapped_lines.append(test_text.strip())
-            remaining = remaining[test_len:].strip()
-        
-        # Draw each line
-        current_y = y
-        for line in wrapped_lines:
-            c.drawString(x, current_y, line)
-            current_y -= line_height
-        
-        # For wrapped text, we return the width of the last line
-        last_line_width = c.stringWidth(wrapped_lines[-1], font_name, font_size)
-        
-        # Return the new y position, line count, and width of the last line
-        return current_y, len(wrapped_lines), last_line_width
+# Function to measure the width of a text from the cached character widths
+def measure_text(text, font_name, font_size):
+    return sum(get_char_widths(text, font_name)) * font_size
+
+# Function to wrap text into lines that fit max_width, preferring to break at spaces
+# Break points are found by binary search over prefix sums of the character widths,
+# and results are memoized so measuring and drawing the same text wraps it only once
+@functools.lru_cache(maxsize=8192)
+def wrap_text(text, max_width, font_name, font_size):
+    prefix_widths = list(itertools.accumulate(get_char_widths(text, font_name), initial=0))
+    max_units = max_width / font_size
+    lines = []
+    start = 0
+    while start < len(text):
+        # Skip the spaces left over from the previous break
+        if text[start] == " ":
+            start += 1
+            continue
+
+        # Longest run of characters from start that still fits (always at least one)
+        end = bisect.bisect_right(prefix_widths, prefix_widths[start] + max_units, lo=start + 1) - 1
+        end = max(end, start + 1)
 
-def create_fallback_qr_code(album_url, temp_dir, size=100):
+        # If this isn't the end, back up to the last space so words stay whole
+        if end < len(text) and text[end] != " ":
+            last_space = text.rfind(" ", start, end)
+            if last_space > start:
+                end = last_space
+
+        lines.append(text[start:end].strip())
+        start = end
+    return tuple(lines) if lines else ("",)
+
+# Font file names tried for Helvetica Inserat in every search directory
+HELVETICA_INSERAT_FILENAMES = ["HelveticaInserat.ttf", "helvetica_inserat.ttf", "Helvetica Inserat.ttf",
+                               "Helvetica-Inserat.ttf", "helveticainserat.ttf"]
+
+# Process-wide font registry, resolved on first use
+_font_registry = None
+
+# Function to list the directories searched for poster fonts, configured ones first
+def font_search_dirs():
+    return FONT_SEARCH_PATHS + [
+        # Windows paths
+        "C:/Windows/Fonts",
+        # macOS paths
+        "/Library/Fonts",
+        "/System/Library/Fonts",
+        # Linux paths
+        "/usr/share/fonts/truetype",
+        # Current directory
+        os.getcwd(),
+    ]
+
+# Function to find and register the poster fonts
+@traced("fonts")
+def resolve_fonts():
+    from reportlab.pdfbase import pdfmetrics
+    from reportlab.pdfbase.ttfonts import TTFont
+    registry = {"body_font": "Helvetica", "title_font": TITLE_FONT_NAME, "fonts": {}, "font_files": {}}
     try:
-        print(f"Creating fallback QR code for URL: {album_url}")
-        
-        # Create QR code for the album URL
-        qr = qrcode.QRCode(
-            version=1,
-            error_correction=qrcode.constants.ERROR_CORRECT_L,
-            box_size=10,
-            border=4,
+        if "Helvetica-Inserat" in pdfmetrics.getRegisteredFontNames():
+            log("Helvetica Inserat font already registered")
+            registry["body_font"] = "Helvetica-Inserat"
+            return registry
+
+        for font_dir in font_search_dirs():
+            for filename in HELVETICA_INSERAT_FILENAMES:
+                font_path = os.path.join(font_dir, filename)
+                if os.path.exists(font_path):
+                    log(f"Found Helvetica Inserat font at: {font_path}")
+                    font = TTFont("Helvetica-Inserat", font_path)
+                    pdfmetrics.registerFont(font)
+                    registry["body_font"] = "Helvetica-Inserat"
+                    registry["fonts"]["Helvetica-Inserat"] = font
+                    registry["font_files"]["Helvetica-Inserat"] = font_path
+                    return registry
+
+        log("Helvetica Inserat font not found, using Helvetica instead.")
+    except Exception as e:
+        log(f"Error registering font: {str(e)}")
+        log_traceback()
+        log("Using Helvetica instead.")
+    return registry
+
+# Function to return the process-wide font registry
+# The first call searches the disk and parses the TTF; later calls (every other poster) reuse it
+def get_font_registry():
+    global _font_registry
+    if _font_registry is None:
+        _font_registry = resolve_fonts()
+        # Warm the width tables for the characters nearly every poster uses
+        for font_name in (_font_registry["body_font"], _font_registry["title_font"]):
+            get_char_widths(string.ascii_uppercase + string.digits + string.punctuation + " ", font_name)
+    return _font_registry
+
+# Poster geometry, in points
+PAGE_MARGIN = 50  # Consistent margin for all sides
+BORDER_WIDTH = 10  # Width of the black frame around the page
+COVER_SIZE = 400  # Album cover is drawn as a square of this size
+COVER_SPACE_AFTER = 40  # Space between the cover and the album title
+SPOTIFY_CODE_PADDING = 15  # Padding between the Spotify code and the border
+TITLE_TO_TRACKLIST_SPACING = 30
+TITLE_FONT_NAME = "Helvetica-Bold"
+
+# Font sizes: the planner picks the largest size between the minimum and the initial one that fits
+INITIAL_ALBUM_TITLE_SIZE = int(30 * 1.35)  # From 30 to ~40
+INITIAL_TRACKLIST_SIZE = int(10 * 1.35 * 0.8 * 1.25)  # Tracklist and artist name, +25% over the original
+MIN_ALBUM_TITLE_SIZE = int(INITIAL_ALBUM_TITLE_SIZE * 0.8)  # Don't go below 80% of the initial size
+MIN_TRACKLIST_SIZE = int(INITIAL_TRACKLIST_SIZE * 0.8)
+FONT_SIZE_STEP = 0.5  # Granularity of the font size search
+
+# Track column counts tried in order; long albums grow to more columns, then to continuation pages
+LAYOUT_COLUMN_COUNTS = (2, 3, 4)
+
+# One string to draw: position, text and font
+TextRun = collections.namedtuple("TextRun", ["x", "y", "text", "font_name", "font_size"])
+
+# Immutable result of the layout planner; drawing just replays the text runs of each page
+# pages[0] is the poster itself, any further pages continue the tracklist
+LayoutPlan = collections.namedtuple("LayoutPlan", ["album_title_size", "tracklist_size", "column_count", "fits", "pages"])
+
+# Function to lay out evenly spaced track columns across the page, as (x, width) pairs
+def column_geometry(page_width, column_count):
+    content_width = page_width - 2 * PAGE_MARGIN
+    column_pitch = content_width / column_count
+    return [(PAGE_MARGIN + i * column_pitch + (10 if i else 0), column_pitch - 10)  # 10px gap between columns
+            for i in range(column_count)]
+
+# Function to derive the page regions the text has to fit in, given the page and Spotify code sizes
+def layout_regions(page_size, spotify_code_size, column_count=2):
+    width, height = page_size
+    spotify_code_width, spotify_code_height = spotify_code_size
+    spotify_code_x = width - BORDER_WIDTH - SPOTIFY_CODE_PADDING - spotify_code_width
+    spotify_code_y = BORDER_WIDTH + SPOTIFY_CODE_PADDING
+
+    # Starting position for album title
+    title_y = height - COVER_SIZE - PAGE_MARGIN - COVER_SPACE_AFTER - 10
+    # Lowest y-position of tracklist so it never overlaps the Spotify code (15px buffer)
+    lowest_y_allowed = spotify_code_y + spotify_code_height + 15
+
+    # Use almost the full width for the title, only leave a small space for artist name
+    title_width = width - 2 * PAGE_MARGIN - 100
+
+    # The last column is narrowed to keep clear of the Spotify code
+    columns = column_geometry(width, column_count)
+    last_column_x, last_column_width = columns[-1]
+    last_column_max_width = spotify_code_x - 20 - last_column_x  # 20px buffer from Spotify code
+    if last_column_max_width > 0:
+        columns[-1] = (last_column_x, min(last_column_width, last_column_max_width))
+
+    return {
+        "title_y": title_y,
+        "title_width": title_width,
+        "available_height": title_y - max(30, lowest_y_allowed),
+        "lowest_y_allowed": lowest_y_allowed,
+        "columns": tuple(columns),
+    }
+
+# Function to split tracks evenly over the columns (extra tracks go in the first columns)
+def split_tracks(tracks, column_count):
+    per_column, extra = divmod(len(tracks), column_count)
+    columns = []
+    start = 0
+    for i in range(column_count):
+        end = start + per_column + (1 if i < extra else 0)
+        columns.append(tracks[start:end])
+        start = end
+    return columns
+
+# Function to calculate the height the title, artist and tracklist need at the given font sizes
+def layout_height(album_name, tracks, font_name, album_title_size, tracklist_size, regions):
+    title_lines = len(wrap_text(album_name, regions["title_width"], font_name, album_title_size))
+    title_height = min(title_lines, 2) * (album_title_size + 5)  # Title wraps to at most 2 lines
+    artist_name_height = tracklist_size + 5
+
+    line_height = tracklist_size + 5
+    tracklist_height = 0
+    for column_tracks, (_, column_width) in zip(split_tracks(tracks, len(regions["columns"])), regions["columns"]):
+        column_height = sum(
+            len(wrap_text(track, column_width, font_name, tracklist_size)) * line_height + 2  # 2 for spacing between tracks
+            for track in column_tracks
         )
-        qr.add_data(album_url)
-        qr.make(fit=True)
-        
-        # Create QR code image
-        qr_img = qr.make_image(fill_color="black", back_color="white")
-        qr_img = qr_img.resize((size, size))
-        
-        # Save the QR code
-        code_path = os.path.join(temp_dir, "spotify_code.png")
-        qr_img.save(code_path, format="PNG")
-        print(f"Fallback QR code saved to: {code_path}")
-        
-        return code_path
+        tracklist_height = max(tracklist_height, column_height)
+
+    return title_height + artist_name_height + TITLE_TO_TRACKLIST_SPACING + tracklist_height
+
+# Function to place the album title and artist name; returns the runs and the y the tracklist starts at
+def build_title_runs(album_name, artist_name, font_name, album_title_size, tracklist_size, regions):
+    text_runs = []
+
+    # Album title, wrapped; the artist name follows the last title line
+    y = regions["title_y"]
+    title_lines = wrap_text(album_name, regions["title_width"], font_name, album_title_size)
+    for line in title_lines:
+        text_runs.append(TextRun(PAGE_MARGIN, y, line, TITLE_FONT_NAME, album_title_size))
+        y -= album_title_size + 5
+    artist_x = PAGE_MARGIN + measure_text(title_lines[-1], font_name, album_title_size) + 10
+    artist_y = y + album_title_size + 5
+    text_runs.append(TextRun(artist_x, artist_y, artist_name, font_name, tracklist_size))
+
+    return text_runs, y - TITLE_TO_TRACKLIST_SPACING
+
+# Function to place tracks split evenly over the columns; tracks running into the Spotify code are dropped
+def build_balanced_track_runs(tracks, font_name, tracklist_size, tracklist_y, regions):
+    text_runs = []
+    line_height = tracklist_size + 5
+    for column_tracks, (column_x, column_width) in zip(split_tracks(tracks, len(regions["columns"])), regions["columns"]):
+        current_y = tracklist_y
+        for track in column_tracks:
+            if current_y <= regions["lowest_y_allowed"]:
+                break
+            for line in wrap_text(track, column_width, font_name, tracklist_size):
+                text_runs.append(TextRun(column_x, current_y, line, font_name, tracklist_size))
+                current_y -= line_height
+            current_y -= 2  # Small extra spacing
+    return text_runs
+
+# Function to pour tracks into the columns top to bottom, moving on to the next column when one is full
+# Returns the runs and the tracks that did not fit, for the next page
+def flow_track_runs(tracks, columns, top_y, bottom_y, font_name, tracklist_size):
+    text_runs = []
+    line_height = tracklist_size + 5
+    next_track = 0  # Walked by index: popping from the front of the list would be quadratic in tracks
+    for column_x, column_width in columns:
+        current_y = top_y
+        while next_track < len(tracks):
+            lines = wrap_text(tracks[next_track], column_width, font_name, tracklist_size)
+            # Always place at least one track per column so an oversized title cannot stall the flow
+            if current_y - (len(lines) - 1) * line_height <= bottom_y and current_y != top_y:
+                break
+            for line in lines:
+                text_runs.append(TextRun(column_x, current_y, line, font_name, tracklist_size))
+                current_y -= line_height
+            current_y -= 2  # Small extra spacing
+            next_track += 1
+    return text_runs, list(tracks[next_track:])
+
+# Function to lay out continuation pages for tracks that did not fit on the poster
+def build_continuation_pages(album_name, tracks, font_name, tracklist_size, page_size, column_count):
+    width, height = page_size
+    columns = column_geometry(width, column_count)
+    header_y = height - PAGE_MARGIN
+    bottom_y = BORDER_WIDTH + SPOTIFY_CODE_PADDING
+    pages = []
+    while tracks:
+        text_runs = [TextRun(PAGE_MARGIN, header_y, f"{album_name} (CONTINUED)", TITLE_FONT_NAME, tracklist_size)]
+        track_runs, tracks = flow_track_runs(tracks, columns, header_y - TITLE_TO_TRACKLIST_SPACING, bottom_y,
+                                             font_name, tracklist_size)
+        pages.append(tuple(text_runs + track_runs))
+    return pages
+
+# Function to plan the poster text layout in one pass
+# For each column count in turn, binary-searches the largest font sizes that fit (track wrapping
+# is memoized, so each probe is cheap). If even the widest layout does not fit at the minimum
+# sizes, the tracklist continues on extra pages. Returns an immutable LayoutPlan that
+# draw_page_text replays onto a canvas
+@traced("layout")
+def plan_layout(album_name, artist_name, tracks, font_name, page_size, spotify_code_size):
+    # Candidate tracklist sizes, smallest first; the title scales along with the tracklist
+    steps = int((INITIAL_TRACKLIST_SIZE - MIN_TRACKLIST_SIZE) / FONT_SIZE_STEP)
+    tracklist_sizes = [MIN_TRACKLIST_SIZE + i * FONT_SIZE_STEP for i in range(steps + 1)]
+    def font_sizes(tracklist_size):
+        album_title_size = INITIAL_ALBUM_TITLE_SIZE * tracklist_size / INITIAL_TRACKLIST_SIZE
+        return max(round(album_title_size / FONT_SIZE_STEP) * FONT_SIZE_STEP, MIN_ALBUM_TITLE_SIZE), tracklist_size
+
+    for column_count in LAYOUT_COLUMN_COUNTS:
+        regions = layout_regions(page_size, spotify_code_size, column_count)
+
+        def fits(tracklist_size):
+            with span("layout_attempt", columns=column_count, tracklist_size=tracklist_size) as attributes:
+                album_title_size, tracklist_size = font_sizes(tracklist_size)
+                required_height = layout_height(album_name, tracks, font_name, album_title_size, tracklist_size, regions)
+                attributes["fits"] = required_height <= regions["available_height"]
+                return attributes["fits"]
+
+        best = None
+        low, high = 0, len(tracklist_sizes) - 1
+        while low <= high:
+            middle = (low + high) // 2
+            if fits(tracklist_sizes[middle]):
+                best = middle
+                low = middle + 1
+            else:
+                high = middle - 1
+
+        if best is not None:
+            album_title_size, tracklist_size = font_sizes(tracklist_sizes[best])
+            log(f"Final font sizes: Album title {album_title_size}, Tracklist {tracklist_size} "
+                  f"({column_count} columns)")
+            text_runs, tracklist_y = build_title_runs(album_name, artist_name, font_name,
+                                                      album_title_size, tracklist_size, regions)
+            text_runs += build_balanced_track_runs(tracks, font_name, tracklist_size, tracklist_y, regions)
+            return LayoutPlan(album_title_size, tracklist_size, column_count, True, (tuple(text_runs),))
+
+    # Nothing fits on one page: widest layout at the minimum sizes, overflow onto continuation pages
+    column_count = LAYOUT_COLUMN_COUNTS[-1]
+    regions = layout_regions(page_size, spotify_code_size, column_count)
+    album_title_size, tracklist_size = font_sizes(tracklist_sizes[0])
+    log(f"Final font sizes: Album title {album_title_size}, Tracklist {tracklist_size} "
+          f"({column_count} columns, tracklist continues on extra pages)")
+    text_runs, tracklist_y = build_title_runs(album_name, artist_name, font_name,
+                                              album_title_size, tracklist_size, regions)
+    track_runs, overflow = flow_track_runs(tracks, regions["columns"], tracklist_y, regions["lowest_y_allowed"],
+                                           font_name, tracklist_size)
+    pages = [tuple(text_runs + track_runs)]
+    pages += build_continuation_pages(album_name, overflow, font_name, tracklist_size, page_size, column_count)
+    return LayoutPlan(album_title_size, tracklist_size, column_count, False, tuple(pages))
+
+# Function to draw the planned text of one page onto the canvas
+def draw_page_text(c, text_runs):
+    from reportlab.lib.colors import black
+    c.setFillColor(black)
+    current_font = None
+    for run in text_runs:
+        if (run.font_name, run.font_size) != current_font:
+            current_font = (run.font_name, run.font_size)
+            c.setFont(run.font_name, run.font_size)
+        c.drawString(run.x, run.y, run.text)
+
+# Function to fill the page with the off-white poster background
+def draw_page_background(c, width, height):
+    from reportlab.lib.colors import HexColor
+    c.setFillColor(HexColor("#F8F8F5"))  # Off-white color
+    c.rect(0, 0, width, height, fill=1, stroke=0)
+
+# Function to draw the black border with a gap of BORDER_WIDTH from the edge
+def draw_page_border(c, width, height):
+    from reportlab.lib.colors import black
+    # Instead of drawing at (0, 0), draw at (BORDER_WIDTH, BORDER_WIDTH)
+    # And reduce the width and height by 2*BORDER_WIDTH
+    c.setStrokeColor(black)
+    c.setLineWidth(BORDER_WIDTH)
+    c.rect(
+        BORDER_WIDTH,           # x position - offset by BORDER_WIDTH from the edge
+        BORDER_WIDTH,           # y position - offset by BORDER_WIDTH from the edge
+        width - 2*BORDER_WIDTH, # width reduced by 2*BORDER_WIDTH
+        height - 2*BORDER_WIDTH,# height reduced by 2*BORDER_WIDTH
+        fill=0, 
+        stroke=1
+    )
+
+# Fallback QR code kept as its module matrix (rows of booleans, quiet zone included) and drawn
+# as vector squares, so nothing is rasterized or embedded and it stays sharp at any print size
+QRCode = collections.namedtuple("QRCode", ["modules", "size"])
+
+# Function to compute the QR module matrix for a URL; memoized, since the matrix only depends on the URL
+@functools.lru_cache(maxsize=1024)
+def qr_code_modules(album_url):
+    import qrcode
+    qr = qrcode.QRCode(
+        version=1,
+        error_correction=qrcode.constants.ERROR_CORRECT_L,
+        border=4,
+    )
+    qr.add_data(album_url)
+    qr.make(fit=True)
+    return tuple(tuple(row) for row in qr.get_matrix())
+
+# Function to create the fallback QR code for an album URL, size points square
+@traced("qr_code")
+def create_fallback_qr_code(album_url, size=100):
+    try:
+        log(f"Creating fallback QR code for URL: {album_url}")
+        qr_code = QRCode(qr_code_modules(album_url), size)
+        log("Fallback QR code created")
+        return qr_code
     except Exception as e:
-        print(f"Error creating fallback QR code: {str(e)}")
-        print(traceback.format_exc())
+        log(f"Error creating fallback QR code: {str(e)}")
+        log_traceback()
         return None
 
-def create_spotify_code(album_url, temp_dir, size=100):
+# Function to return the image URL of the official Spotify code for an album
+# Modified: Use the same off-white color (F8F8F5) as the poster background
+def spotify_code_image_url(album_id):
+    return f"{SPOTIFY_CODE_URL}/uri/plain/png/F8F8F5/black/640/spotify:album:{album_id}"
+
+# Function to return the asset cache key of a Spotify code: its image URL plus how it was prepared
+def spotify_code_cache_key(spotify_code_url):
+    mode = "gray" if output_profile()["grayscale_code"] else "rgb"
+    return f"spotify_code:250w:{mode}:{spotify_code_url}"
+
+# Function to create the Spotify code for an album and return it as an ImageAsset
+# (or a vector QRCode when the code cannot be fetched)
+@traced("spotify_code")
+def create_spotify_code(album_url, size=100):
+    from PIL import Image
+    from reportlab.lib.utils import ImageReader
     try:
-        print(f"Creating Spotify code for URL: {album_url}")
+        log(f"Creating Spotify code for URL: {album_url}")
         
         # Extract Spotify ID from URL
         if "spotify.com/album/" in album_url:
-            album_id = album_url.split("/")[-1].split("?")[0]
+            album_id = extract_album_id(album_url)
         else:
-            print("Invalid Spotify URL format. Using fallback QR code.")
-            return create_fallback_qr_code(album_url, temp_dir, size)
+            log("Invalid Spotify URL format. Using fallback QR code.")
+            return create_fallback_qr_code(album_url, size)
         
         # Use Spotify's official code API
-        # Modified: Use the same off-white color (F8F8F5) as the poster background
-        spotify_code_url = f"https://scannables.scdn.co/uri/plain/png/F8F8F5/black/640/spotify:album:{album_id}"
+        spotify_code_url = spotify_code_image_url(album_id)
+
+        # The cache holds the already resized PNG, so a hit skips the download and the resize
+        cache_key = spotify_code_cache_key(spotify_code_url)
+        cached = load_cached_asset(cache_key)
+        if cached is not None:
+            log(f"Using cached Spotify code for: {spotify_code_url}")
+            return ImageAsset(ImageReader(BytesIO(cached)), Image.open(BytesIO(cached)))
         
         try:
-            print(f"Fetching Spotify code from: {spotify_code_url}")
-            code_response = requests.get(spotify_code_url, timeout=10)
-            code_response.raise_for_status()
-            
-            # Save the Spotify code image
-            spotify_code = Image.open(BytesIO(code_response.content))
-            
-            # Make the code wider by setting a fixed width and proportional height
-            new_width = 250  # Wider fixed width
-            original_width, original_height = spotify_code.size
-            new_height = int((new_width / original_width) * original_height)
+            log(f"Fetching Spotify code from: {spotify_code_url}")
+            with span("spotify_code_download"):
+                code_response = get_http_session().get(spotify_code_url, timeout=HTTP_TIMEOUT)
+                code_response.raise_for_status()
             
-            spotify_code = spotify_code.resize((new_width, new_height), Image.LANCZOS)
-            
-            code_path = os.path.join(temp_dir, "spotify_code.png")
-            spotify_code.save(code_path, format="PNG")
-            print(f"Spotify code saved to: {code_path}")
+            with span("spotify_code_resize"):
+                # Save the Spotify code image
+                spotify_code = Image.open(BytesIO(code_response.content))
+                
+                # Make the code wider by setting a fixed width and proportional height
+                new_width = 250  # Wider fixed width
+                original_width, original_height = spotify_code.size
+                new_height = int((new_width / original_width) * original_height)
+                
+                spotify_code = spotify_code.resize((new_width, new_height), Image.LANCZOS)
+                if output_profile()["grayscale_code"]:
+                    spotify_code = spotify_code.convert("L")
+                
+                buffer = BytesIO()
+                spotify_code.save(buffer, format="PNG")
+            save_asset_to_cache(cache_key, buffer.getvalue())
+            log("Spotify code downloaded and resized successfully")
             
-            return code_path
+            # Hand the already decoded image to ReportLab so it is not decoded a second time
+            return ImageAsset(ImageReader(spotify_code), spotify_code)
         except Exception as e:
-            print(f"Error fetching Spotify code: {str(e)}")
-            print(traceback.format_exc())
-            print("Using fallback QR code instead.")
-            return create_fallback_qr_code(album_url, temp_dir, size)
+            log(f"Error fetching Spotify code: {str(e)}")
+            log_traceback()
+            log("Using fallback QR code instead.")
+            return create_fallback_qr_code(album_url, size)
             
     except Exception as e:
-        print(f"Error creating Spotify code: {str(e)}")
-        print(traceback.format_exc())
-        return create_fallback_qr_code(album_url, temp_dir, size)
+        log(f"Error creating Spotify code: {str(e)}")
+        log_traceback()
+        return create_fallback_qr_code(album_url, size)
+
+# Function to return the shared thread pool used for asset downloads
+def get_asset_executor():
+    global _asset_executor
+    if _asset_executor is None:
+        from concurrent.futures import ThreadPoolExecutor
+        _asset_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="posterfy-assets")
+    return _asset_executor
+
+# Function to start the Spotify code and album cover downloads in parallel
+# Returns futures so the caller only blocks on an asset when it actually needs it
+def start_asset_downloads(album_details):
+    executor = get_asset_executor()
+    assets = {"spotify_code": executor.submit(create_spotify_code, album_details["album_url"])}
+    if album_details["album_cover_url"]:
+        size = cover_pixel_size()
+        assets["album_cover"] = executor.submit(download_album_cover, choose_cover_url(album_details, size), size)
+    else:
+        assets["album_cover"] = None
+    return assets
+
+# Function to draw a full-page layer (background or border); in a catalog the layer is drawn
+# once into a shared PDF form and every later page only references it
+def draw_page_layer(c, draw_layer, width, height, shared_forms=None):
+    if shared_forms is None:
+        draw_layer(c, width, height)
+        return
+    form_name = shared_forms.get(draw_layer.__name__)
+    if form_name is None:
+        form_name = shared_forms[draw_layer.__name__] = f"posterfy_{draw_layer.__name__}"
+        c.beginForm(form_name)
+        draw_layer(c, width, height)
+        c.endForm()
+    c.doForm(form_name)
+
+# Function to draw a fallback QR code as vector rectangles, one per horizontal run of dark modules
+def draw_qr_code(c, qr_code, x, y):
+    from reportlab.lib.colors import black, HexColor
+    module_count = len(qr_code.modules)
+    c.saveState()
+    # Work in module units with the origin at the top left, so every rectangle has integer coordinates
+    c.translate(x, y + qr_code.size)
+    c.scale(qr_code.size / module_count, -qr_code.size / module_count)
+    c.setFillColor(HexColor("#FFFFFF"))
+    c.rect(0, 0, module_count, module_count, fill=1, stroke=0)
+
+    path = c.beginPath()
+    for row_index, row in enumerate(qr_code.modules):
+        run_start = None
+        for column_index, dark in enumerate(row + (False,)):
+            if dark and run_start is None:
+                run_start = column_index
+            elif not dark and run_start is not None:
+                path.rect(run_start, row_index, column_index - run_start, 1)
+                run_start = None
+    c.setFillColor(black)
+    c.drawPath(path, fill=1, stroke=0)
+    c.restoreState()
+
+# Function to return the drawn size of a Spotify code image or fallback QR code
+def spotify_code_size(spotify_code):
+    if isinstance(spotify_code, QRCode):
+        return spotify_code.size, spotify_code.size
+    return spotify_code.image.size
+
+# Everything the first page of a poster is drawn from: the layout plan, the assets and where they go
+# Boxes are (x, y, width, height) in points with the origin at the bottom left, as on the PDF page
+PosterParts = collections.namedtuple("PosterParts", ["plan", "album_cover", "cover_box", "spotify_code",
+                                                     "spotify_code_box"])
+
+# Function to wait for a poster's assets and plan its layout; shared by the PDF and the preview renderer
+def prepare_poster(album_details, assets):
+    album_name = album_details["album_name"].upper()  # Convert to uppercase
+    artist_name = album_details["artist_name"].upper()  # Convert to uppercase
+    tracks = [track.upper() for track in album_details["tracks"]]  # Convert all tracks to uppercase
+    width, height = A4
+    
+    # Fonts are looked up and registered once per process
+    font_name = get_font_registry()["body_font"]
+    
+    # Wait for the Spotify code (inverted colors, wider format) started at the top
+    with span("wait_spotify_code"):
+        spotify_code = assets["spotify_code"].result()
+    
+    # Get actual dimensions of the Spotify code
+    spotify_code_width, spotify_code_height = spotify_code_size(spotify_code)
+    
+    # Area for Spotify code - bottom right corner, with padding from border
+    spotify_code_x = width - BORDER_WIDTH - SPOTIFY_CODE_PADDING - spotify_code_width
+    spotify_code_y = BORDER_WIDTH + SPOTIFY_CODE_PADDING
+    
+    album_cover = None
+    if assets["album_cover"] is not None:
+        log("Processing album cover")
+        with span("wait_album_cover"):
+            album_cover = assets["album_cover"].result()
+    
+    # Plan the title, artist name and tracklist once, then replay the plan onto the page
+    plan = plan_layout(album_name, artist_name, tracks, font_name, (width, height),
+                       (spotify_code_width, spotify_code_height))
+    
+    cover_box = ((width - COVER_SIZE) / 2, height - COVER_SIZE - PAGE_MARGIN, COVER_SIZE, COVER_SIZE)
+    return PosterParts(plan, album_cover, cover_box, spotify_code,
+                       (spotify_code_x, spotify_code_y, spotify_code_width, spotify_code_height))
+
+# Function to draw every page of one album poster onto the canvas and return its layout plan
+# Waits for the assets and plans the layout before drawing anything, so a failure leaves the page untouched
+# The caller starts the next page (showPage) and saves the canvas
+def draw_poster(c, album_details, assets, shared_forms=None):
+    width, height = A4
+    parts = prepare_poster(album_details, assets)
+    plan, album_cover, spotify_code = parts.plan, parts.album_cover, parts.spotify_code
+    spotify_code_x, spotify_code_y, spotify_code_width, spotify_code_height = parts.spotify_code_box
+    
+    # Fill the entire page with off-white background
+    draw_page_layer(c, draw_page_background, width, height, shared_forms)
+    
+    # Draw album cover if available
+    if album_cover:
+        # ReportLab embeds each distinct image once per document, however many pages draw it
+        c.drawImage(album_cover.reader, *parts.cover_box)
+        log("Album cover added to PDF")
+    
+    log("Adding album title, artist name and tracklist")
+    draw_page_text(c, plan.pages[0])
+    
+    # Draw Spotify code in bottom right corner with its new dimensions
+    if isinstance(spotify_code, QRCode):
+        log(f"Adding fallback QR code at position ({spotify_code_x}, {spotify_code_y})")
+        draw_qr_code(c, spotify_code, spotify_code_x, spotify_code_y)
+    elif spotify_code:
+        log(f"Adding Spotify code at position ({spotify_code_x}, {spotify_code_y})")
+        c.drawImage(spotify_code.reader, spotify_code_x, spotify_code_y, width=spotify_code_width, height=spotify_code_height)
+    
+    draw_page_layer(c, draw_page_border, width, height, shared_forms)
+    
+    # Very long albums continue their tracklist on extra pages
+    for page_text_runs in plan.pages[1:]:
+        c.showPage()
+        draw_page_layer(c, draw_page_background, width, height, shared_forms)
+        draw_page_text(c, page_text_runs)
+        draw_page_layer(c, draw_page_border, width, height, shared_forms)
+    if len(plan.pages) > 1:
+        log(f"Tracklist continues on {len(plan.pages) - 1} extra page(s)")
+    return plan
+
+# Bump whenever the drawing code changes in a way the layout parameters below do not capture,
+# so the next incremental batch run re-renders every poster once
+RENDER_VERSION = 1
+
+# Posters carry their manifest hash in the PDF keywords, as this prefix followed by 64 hex digits
+RENDER_MANIFEST_PREFIX = "posterfy-manifest:"
+RENDER_MANIFEST_PATTERN = re.compile(rb"posterfy-manifest:([0-9a-f]{64})")
 
-def generate_pdf(album_details, temp_dir):
+# Process-wide fingerprint of the poster fonts, computed on first use
+_font_fingerprint = None
+
+# Function to fingerprint the poster fonts: their names plus the contents of any font files
+def font_fingerprint():
+    global _font_fingerprint
+    if _font_fingerprint is None:
+        registry = get_font_registry()
+        digest = hashlib.sha256(f"{registry['body_font']}|{registry['title_font']}".encode("utf-8"))
+        for font_name, font_path in sorted(registry["font_files"].items()):
+            with open(font_path, "rb") as f:
+                digest.update(font_name.encode("utf-8") + hashlib.sha256(f.read()).digest())
+        _font_fingerprint = digest.hexdigest()
+    return _font_fingerprint
+
+# Function to list everything besides the album itself that decides how a poster looks
+def layout_parameters():
+    return {
+        "render_version": RENDER_VERSION,
+        "page_size": A4,
+        "geometry": [PAGE_MARGIN, BORDER_WIDTH, COVER_SIZE, COVER_SPACE_AFTER, SPOTIFY_CODE_PADDING,
+                     TITLE_TO_TRACKLIST_SPACING],
+        "font_sizes": [INITIAL_ALBUM_TITLE_SIZE, INITIAL_TRACKLIST_SIZE, MIN_ALBUM_TITLE_SIZE, MIN_TRACKLIST_SIZE,
+                       FONT_SIZE_STEP],
+        "column_counts": LAYOUT_COLUMN_COUNTS,
+        "output_profile": output_profile(),
+        "cover_quality": cover_quality(),
+    }
+
+# Function to describe every input of a poster: album details, asset identities, fonts and layout
+# Spotify image URLs change whenever the image does, so an asset is identified by its cache key
+# (source URL and processing) rather than by downloading it again
+def render_manifest(album_details):
+    album_url = album_details["album_url"]
+    # The URL as typed (locale, ?si= tracking) does not change the poster, the album ID does
+    album = {key: value for key, value in album_details.items() if key not in ("album_url", "success")}
+    album["album_id"] = extract_album_id(album_url)
+    size = cover_pixel_size()
+    album_cover = (album_cover_cache_key(choose_cover_url(album_details, size), size)
+                   if album_details["album_cover_url"] else None)
+    spotify_code = (spotify_code_cache_key(spotify_code_image_url(album["album_id"]))
+                    if "spotify.com/album/" in album_url else f"qr_code:{album_url}")
+    return {
+        "album": album,
+        "assets": {"album_cover": album_cover, "spotify_code": spotify_code},
+        "fonts": font_fingerprint(),
+        "layout": layout_parameters(),
+    }
+
+# Function to hash a poster's render manifest
+def render_manifest_hash(album_details):
+    manifest = json.dumps(render_manifest(album_details), sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(manifest.encode("utf-8")).hexdigest()
+
+# Function to read the manifest hash back from a rendered PDF, or None if it has none (or does not exist)
+def read_pdf_manifest_hash(pdf_path):
+    try:
+        with open(pdf_path, "rb") as f:
+            match = RENDER_MANIFEST_PATTERN.search(f.read())
+    except OSError:
+        return None
+    return match.group(1).decode("ascii") if match else None
+
+# Function to check that a poster got the assets its manifest promises: a poster that fell back to
+# the QR code or lost its cover after a download error must not look up to date on the next run
+def assets_complete(album_details, assets):
+    spotify_code = assets["spotify_code"].result()
+    wants_qr_code = "spotify.com/album/" not in album_details["album_url"]
+    if spotify_code is None or isinstance(spotify_code, QRCode) != wants_qr_code:
+        return False
+    return not album_details["album_cover_url"] or assets["album_cover"].result() is not None
+
+# Function to return the file name of an album's poster (or of its preview, with another extension)
+# with_album_id tells apart releases that share artist and title, such as a single and its album
+def poster_filename(album_details, extension=".pdf", with_album_id=False):
+    name = f"{album_details['artist_name'].upper()} - {album_details['album_name'].upper()}"
+    if with_album_id:
+        name += f" [{extract_album_id(album_details['album_url'])}]"
+    return safe_filename(name) + extension
+
+# Function to return a Content-Disposition header value for a file name
+# HTTP headers are Latin-1, so the name is sent as an ASCII fallback plus the RFC 5987 UTF-8 form
+def content_disposition(filename, disposition="inline"):
+    import unicodedata
+    # Accented letters keep their base letter; anything else outside printable ASCII becomes "_"
+    fallback = "".join(char if " " <= char <= "~" and char not in '"\\' else "_"
+                       for char in unicodedata.normalize("NFKD", filename) if not unicodedata.combining(char))
+    return f"{disposition}; filename=\"{fallback}\"; filename*=UTF-8''{urllib.parse.quote(filename, safe='')}"
+
+# Function to apply the output profile's stream encoding while a PDF is built
+# ReportLab reads the ASCII85 switch from its global config whenever it creates a stream
+@contextlib.contextmanager
+def pdf_stream_encoding(profile):
+    from reportlab import rl_config
+    previous = rl_config.useA85
+    rl_config.useA85 = int(profile["ascii85"])
+    try:
+        yield
+    finally:
+        rl_config.useA85 = previous
+
+# Function to classify a PDF object from the start of its dictionary, as (kind, description)
+def describe_pdf_object(header):
+    filters = ", ".join(name.decode("ascii") for name in re.findall(rb"/(\w+)Decode", header)) or "uncompressed"
+    if b"/Subtype /Image" in header:
+        size = re.search(rb"/Width (\d+)", header), re.search(rb"/Height (\d+)", header)
+        color_space = re.search(rb"/ColorSpace /(\w+)", header)
+        return "image", (f"image {int(size[0].group(1))}x{int(size[1].group(1))} "
+                         f"{color_space.group(1).decode('ascii') if color_space else ''} ({filters})")
+    if b"/Length1" in header:
+        return "font", f"embedded font file ({filters})"
+    if b"/Subtype /Form" in header:
+        return "content", f"shared form ({filters})"
+    if b"stream" in header:
+        return "content", f"page content ({filters})"
+    if b"/Type /Font" in header or b"/Type /FontDescriptor" in header:
+        return "font", "font dictionary"
+    return "structure", "document structure"
+
+# Function to measure every object of a finished PDF, using the offsets in its cross-reference table
+# Returns (object number, kind, description, bytes) tuples in file order
+def pdf_object_sizes(pdf_bytes):
+    xref_offset = int(re.search(rb"startxref\s+(\d+)", pdf_bytes[-64:]).group(1))
+    xref_end = pdf_bytes.find(b"trailer", xref_offset)
+    offsets = sorted(int(offset) for offset in re.findall(rb"(\d{10}) \d{5} n", pdf_bytes[xref_offset:xref_end]))
+    objects = []
+    for start, end in zip(offsets, offsets[1:] + [xref_offset]):
+        header = pdf_bytes[start:min(end, start + 1024)]
+        kind, description = describe_pdf_object(header)
+        objects.append((int(header.split(b" ", 1)[0]), kind, description, end - start))
+    return objects
+
+# Function to log the size of every embedded object of a PDF and return the totals per kind,
+# e.g. {"pdf_bytes": 81234, "image_bytes": 64000, "font_bytes": 0, ...} for the pdf_save span
+def report_pdf_objects(pdf_bytes):
+    totals = {"pdf_bytes": len(pdf_bytes), "image_bytes": 0, "font_bytes": 0, "content_bytes": 0, "structure_bytes": 0}
+    for number, kind, description, size in pdf_object_sizes(pdf_bytes):
+        totals[f"{kind}_bytes"] += size
+        if kind != "structure":
+            log(f"PDF object {number}: {description}, {size} bytes")
+    log(f"PDF size: {len(pdf_bytes)} bytes ({totals['image_bytes']} images, {totals['font_bytes']} fonts, "
+        f"{totals['content_bytes']} page content, {totals['structure_bytes']} structure)")
+    return totals
+
+# The PDF is written to output_dir (default: the current directory), or to output when given:
+# a file path, or any writable binary stream such as a BytesIO, sys.stdout.buffer or an upload body
+# Returns the path written to, or the poster's file name for stream output; None on failure
+@traced("render")
+def generate_pdf(album_details, assets=None, output_dir=None, output=None):
+    from reportlab.pdfgen import canvas
     try:
-        print("Starting PDF generation")
-        album_name = album_details["album_name"].upper()  # Convert to uppercase
-        artist_name = album_details["artist_name"].upper()  # Convert to uppercase
-        tracks = [track.upper() for track in album_details["tracks"]]  # Convert all tracks to uppercase
-        album_url = album_details["album_url"]  # URL for Spotify code
+        log("Starting PDF generation")
+        # Kick off both network downloads first so they overlap with each other and with font setup
+        if assets is None:
+            assets = start_asset_downloads(album_details)
         
         # Create safe filename
-        safe_name = safe_filename(f"{artist_name} - {album_name}")
-        
-        # Save PDF in current working directory
-        current_dir = os.getcwd()
-        pdf_filename = os.path.join(current_dir, f"{safe_name}.pdf")
-        print(f"PDF will be saved as: {pdf_filename}")
-        
-        # Create PDF canvas
-        print("Creating PDF canvas")
-        c = canvas.Canvas(pdf_filename, pagesize=A4)
-        width, height = A4
-        print(f"PDF dimensions: {width}x{height}")
-        
-        # Define margins and border width - INCREASED FOR VISIBILITY
-        margin = 50  # Consistent margin for all sides
-        border_width = 10  # Increased from 2 to 5 for better visibility
-        
-        # Define inner content area with some padding from the border
-        border_padding = 5  # Space between border and content
-        inner_x = border_width + border_padding
-        inner_y = border_width + border_padding
-        inner_width = width - 2 * (border_width + border_padding)
-        inner_height = height - 2 * (border_width + border_padding)
-        
-        # Set off-white background with inset from border
-        # Instead of filling the entire page, fill only the inner area
-        # This ensures the border will be visible
-        # Fill the entire page with off-white background
-        c.setFillColor(HexColor("#F8F8F5"))  # Off-white color
-        c.rect(0, 0, width, height, fill=1, stroke=0)
-        
-        # Try to register Helvetica Inserat font if available
-        font_name = "Helvetica"  # Default font
-        try:
-            # Check if Helvetica Inserat font is already registered in ReportLab
-            helvetica_inserat_registered = False
-            for font in pdfmetrics.getRegisteredFontNames():
-                if font == "Helvetica-Inserat":
-                    helvetica_inserat_registered = True
-                    break
-            
-            if not helvetica_inserat_registered:
-                # Try to find Helvetica Inserat font on system
-                possible_paths = [
-                    # Windows paths
-                    "C:/Windows/Fonts/HelveticaInserat.ttf",
-                    "C:/Windows/Fonts/helvetica_inserat.ttf",
-                    "C:/Windows/Fonts/Helvetica Inserat.ttf",
-                    # macOS paths
-                    "/Library/Fonts/Helvetica Inserat.ttf",
-                    "/System/Library/Fonts/Helvetica Inserat.ttf",
-                    # Linux paths
-                    "/usr/share/fonts/truetype/Helvetica-Inserat.ttf",
-                    # Current directory
-                    os.path.join(current_dir, "helveticainserat.ttf"),
-                    os.path.join(current_dir, "Helvetica-Inserat.ttf"),
-                    os.path.join(current_dir, "Helvetica Inserat.ttf"),
-                ]
-                
-                for font_path in possible_paths:
-                    if os.path.exists(font_path):
-                        print(f"Found Helvetica Inserat font at: {font_path}")
-                        pdfmetrics.registerFont(TTFont("Helvetica-Inserat", font_path))
-                        font_name = "Helvetica-Inserat"
-                        break
-                        
-                if font_name == "Helvetica":
-                    print("Helvetica Inserat font not found, using Helvetica instead.")
-            else:
-                font_name = "Helvetica-Inserat"
-                print("Helvetica Inserat font already registered")
-                
-        except Exception as e:
-            print(f"Error registering font: {str(e)}")
-            print(traceback.format_exc())
-            print("Using Helvetica instead.")
-        
-        # Create Spotify code with inverted colors and wider format
-        spotify_code_path = create_spotify_code(album_url, temp_dir)
-        
-        # Get actual dimensions of the Spotify code
-        spotify_code_img = Image.open(spotify_code_path)
-        spotify_code_width, spotify_code_height = spotify_code_img.size
-        
-        # Area for Spotify code - bottom right corner, with padding from border
-        spotify_code_padding = 15  # Padding from border
-        spotify_code_x = width - border_width - spotify_code_padding - spotify_code_width
-        spotify_code_y = border_width + spotify_code_padding
-        
-        # Draw album cover if available
-        cover_height = 400
-        cover_top_margin = margin
-        cover_space_after = 40  # Increased space after cover
-        if album_details["album_cover_url"]:
-            print("Processing album cover")
-            album_cover = download_album_cover(album_details["album_cover_url"])
-            if album_cover:
-                img_path = os.path.join(temp_dir, "album_cover.png")
-                print(f"Saving album cover to: {img_path}")
-                album_cover.save(img_path, format="PNG")
-                c.drawImage(img_path, (width - cover_height) / 2, height - cover_height - cover_top_margin, 
-                            width=cover_height, height=cover_height)
-                print("Album cover added to PDF")
-        
-        # Starting position for album title
-        title_y = height - cover_height - cover_top_margin - cover_space_after - 10
-        
-        # Initial font sizes
-        initial_album_title_size = int(30 * 1.35)  # From 30 to ~40
-        # MODIFIED: Increased tracklist and artist name font size by 25%
-        initial_tracklist_size = int(10 * 1.35 * 0.8 * 1.25)  # Original * 1.25 for 25% increase
-        
-        # Define minimum font sizes - don't go below these values
-        min_album_title_size = int(initial_album_title_size * 0.8)  # 80% of initial size
-        min_tracklist_size = int(initial_tracklist_size * 0.8)  # 80% of initial size
-        
-        # Bottom margin needs to account for Spotify code
-        bottom_margin = max(30, spotify_code_y + spotify_code_height + 15)  # Ensure minimum 30px or enough for code
-        
-        # Available height for content (excluding cover)
-        available_height = title_y - bottom_margin
-        
-        # Calculate initial layout parameters for album title and tracklist
-        album_title_size = initial_album_title_size
-        tracklist_size = initial_tracklist_size
-        
-        # Define column widths for text wrapping
-        # Adjust second column width to avoid overlap with Spotify code
-        first_column_width = (width - 2 * margin) / 2 - 10  # Subtract some padding between columns
-        second_column_width = (width - 2 * margin) / 2 - 10  # Subtract some padding between columns
-        
-        # Ensure tracklist doesn't overlap with Spotify code by adjusting track list boundaries
-        second_column_max_right = spotify_code_x - 20  # 20px buffer from Spotify code
-        second_column_max_width = second_column_max_right - (width / 2 + 10)  # Max width to avoid overlap
-        if second_column_max_width > 0:
-            second_column_width = min(second_column_width, second_column_max_width)
+        safe_name = poster_filename(album_details)
         
-        # Attempt layout with initial font sizes
-        layout_successful = False
-        font_reduction_attempts = 0
-        max_font_reduction_attempts = 3  # Limit how many times we reduce the font
+        # Save PDF in the output directory, unless the caller supplied a stream
+        if output is None:
+            output = os.path.join(output_dir or os.getcwd(), safe_name)
+        if isinstance(output, str):
+            pdf_filename = output
+            log(f"PDF will be saved as: {pdf_filename}")
+        else:
+            pdf_filename = safe_name
+            log(f"PDF will be written to a stream as: {pdf_filename}")
         
-        while not layout_successful and font_reduction_attempts <= max_font_reduction_attempts:
-            # Set text color
-            c.setFillColor(black)
-            
-            # Temporary canvas for calculations
-            temp_canvas = canvas.Canvas(None)
-            temp_canvas.setFont("Helvetica-Bold", album_title_size)
-            
-            # MODIFIED: Increase the width for album title to use more horizontal space
-            # Use almost the full width for the title, only leave a small space for artist name
-            title_width = width - 2 * margin - 100  # Reduced reservation from 200 to 100
-            lines_needed = calculate_lines_needed(temp_canvas, album_name, title_width, font_name, album_title_size)
-            
-            # Limit album title wrapping to max 2 lines
-            if lines_needed > 2:
-                lines_needed = 2  # Force to 2 lines
+        # Create PDF canvas; the PDF is built in memory so its objects can be measured before it is written
+        log(f"Creating PDF canvas ({OUTPUT_PROFILE} profile)")
+        profile = output_profile()
+        buffer = BytesIO()
+        with pdf_stream_encoding(profile):
+            c = canvas.Canvas(buffer, pagesize=A4, pageCompression=profile["page_compression"])
+            width, height = A4
+            log(f"PDF dimensions: {width}x{height}")
             
-            title_height = lines_needed * (album_title_size + 5)
-            artist_name_height = tracklist_size + 5  # Height for artist name
+            # Draw the poster (and any continuation pages)
+            plan = draw_poster(c, album_details, assets)
             
-            # Space between elements
-            title_to_tracklist_spacing = 30
+            # Record what the poster was rendered from, so incremental batch runs can skip it next time
+            if assets_complete(album_details, assets):
+                c.setKeywords(RENDER_MANIFEST_PREFIX + render_manifest_hash(album_details))
             
-            # Calculate how much space we need for tracklist
-            tracklist_height = calculate_tracklist_height(
-                temp_canvas, tracks, first_column_width, second_column_width, 
-                font_name, tracklist_size
-            )
-            
-            # Calculate total required height
-            total_required_height = title_height + artist_name_height + title_to_tracklist_spacing + tracklist_height
-            
-            # Check if everything fits
-            if total_required_height <= available_height:
-                layout_successful = True
+            log("Saving PDF")
+            with span("pdf_save", pages=len(plan.pages), profile=OUTPUT_PROFILE) as attributes:
+                c.save()
+                pdf_bytes = buffer.getvalue()
+                # Measuring is diagnostics only; a PDF it cannot parse is still written
+                try:
+                    attributes.update(report_pdf_objects(pdf_bytes))
+                except Exception as e:
+                    log(f"Error measuring PDF objects: {str(e)}")
+                    log_traceback()
+                if isinstance(output, str):
+                    with open(output, "wb") as f:
+                        f.write(pdf_bytes)
+                else:
+                    output.write(pdf_bytes)
+        log(f"PDF successfully generated: {pdf_filename}")
+        return pdf_filename
+    except Exception as e:
+        log(f"Error generating PDF: {str(e)}")
+        log_traceback()
+        return None
+
+# Font files that stand in for the PDF's built-in fonts in previews, most similar first
+# (the PDF viewer supplies Helvetica itself, but Pillow needs a font file to draw with)
+PREVIEW_FONT_FILENAMES = {
+    "Helvetica": ["Helvetica.ttf", "Arial.ttf", "arial.ttf", "LiberationSans-Regular.ttf", "Arimo-Regular.ttf",
+                  "NimbusSans-Regular.ttf", "DejaVuSans.ttf"],
+    "Helvetica-Bold": ["Helvetica-Bold.ttf", "Arial Bold.ttf", "arialbd.ttf", "LiberationSans-Bold.ttf",
+                       "Arimo-Bold.ttf", "NimbusSans-Bold.ttf", "DejaVuSans-Bold.ttf"],
+}
+
+# Function to find the font file a preview draws a poster font with, or None if there is none
+# A registered TTF is used as-is; built-in fonts are looked up in the font directories and,
+# since fonts are often kept in one subdirectory per family, one level below them
+@functools.lru_cache(maxsize=None)
+def preview_font_file(font_name):
+    font_file = get_font_registry()["font_files"].get(font_name)
+    if font_file:
+        return font_file
+    directories = []
+    for font_dir in font_search_dirs():
+        if os.path.isdir(font_dir):
+            directories.append(font_dir)
+            directories += sorted(entry.path for entry in os.scandir(font_dir) if entry.is_dir())
+    for filename in PREVIEW_FONT_FILENAMES.get(font_name, PREVIEW_FONT_FILENAMES["Helvetica"]):
+        for directory in directories:
+            font_path = os.path.join(directory, filename)
+            if os.path.isfile(font_path):
+                log(f"Previews draw {font_name} with: {font_path}")
+                return font_path
+    log(f"No font file found for {font_name}, previews use Pillow's default font")
+    return None
+
+# Function to return a Pillow font for a poster font at a size in pixels; memoized per size
+@functools.lru_cache(maxsize=256)
+def preview_font(font_name, pixel_size):
+    from PIL import ImageFont
+    font_file = preview_font_file(font_name)
+    if font_file is None:
+        return ImageFont.load_default(pixel_size)
+    return ImageFont.truetype(font_file, pixel_size)
+
+# Function to return the Pillow font for one text run of the layout plan
+# The plan was measured with the PDF font's metrics; a wider stand-in font is shrunk (in quarter-pixel
+# steps, to keep the font cache small) until the run fits the width the plan gave it
+def preview_run_font(run, scale):
+    pixel_size = run.font_size * scale
+    font = preview_font(run.font_name, pixel_size)
+    if preview_font_file(run.font_name) == get_font_registry()["font_files"].get(run.font_name):
+        return font
+    planned_width = measure_text(run.text, run.font_name, run.font_size) * scale
+    drawn_width = font.getlength(run.text)
+    if drawn_width > planned_width > 0:
+        font = preview_font(run.font_name, math.floor(pixel_size * planned_width / drawn_width * 4) / 4)
+    return font
+
+# Function to convert a box in PDF points (origin bottom left) to a pixel box (left, top, width, height)
+def preview_box(box, scale):
+    x, y, width, height = box
+    return (round(x * scale), round((A4[1] - y - height) * scale),
+            max(1, round(width * scale)), max(1, round(height * scale)))
+
+# Function to scale an image asset into place on the preview
+def paste_preview_image(image, asset, box, scale):
+    from PIL import Image
+    left, top, width, height = preview_box(box, scale)
+    source = asset.image.convert("RGB")
+    image.paste(source.resize((width, height), resample=Image.LANCZOS, reducing_gap=3.0), (left, top))
+
+# Function to draw the fallback QR code on the preview: one pixel per module, scaled up without smoothing
+def paste_preview_qr_code(image, qr_code, box, scale):
+    from PIL import Image
+    left, top, width, height = preview_box(box, scale)
+    module_count = len(qr_code.modules)
+    modules = Image.new("L", (module_count, module_count))
+    modules.putdata([0 if dark else 255 for row in qr_code.modules for dark in row])
+    image.paste(modules.resize((width, height), resample=Image.NEAREST).convert("RGB"), (left, top))
+
+# Function to render the first page of a poster straight to a PNG or WebP image, width pixels wide
+# Uses the same layout plan and assets as the PDF, so text breaks and font sizes match it exactly;
+# only the glyphs can differ where the preview has to stand in for a built-in PDF font
+# Returns the image bytes, or None on failure
+@traced("preview")
+def render_preview(album_details, assets=None, width=None, image_format="png"):
+    from PIL import Image, ImageDraw
+    try:
+        width = width or PREVIEW_WIDTH
+        log(f"Starting {width}px {image_format.upper()} preview")
+        if assets is None:
+            assets = start_asset_downloads(album_details)
+        parts = prepare_poster(album_details, assets)
+
+        page_width, page_height = A4
+        scale = width / page_width
+        image = Image.new("RGB", (width, round(page_height * scale)), "#F8F8F5")  # Off-white background
+        if parts.album_cover:
+            paste_preview_image(image, parts.album_cover, parts.cover_box, scale)
+        if isinstance(parts.spotify_code, QRCode):
+            paste_preview_qr_code(image, parts.spotify_code, parts.spotify_code_box, scale)
+        elif parts.spotify_code:
+            paste_preview_image(image, parts.spotify_code, parts.spotify_code_box, scale)
+
+        draw = ImageDraw.Draw(image)
+        for run in parts.plan.pages[0]:
+            # Text runs are positioned by their baseline, like drawString
+            draw.text((run.x * scale, (page_height - run.y) * scale), run.text, fill="black",
+                      font=preview_run_font(run, scale), anchor="ls")
+        # The PDF strokes the border centred on a rectangle BORDER_WIDTH in from the edge
+        inset = BORDER_WIDTH / 2 * scale
+        draw.rectangle((inset, inset, image.width - 1 - inset, image.height - 1 - inset), outline="black",
+                       width=max(1, round(BORDER_WIDTH * scale)))
+
+        buffer = BytesIO()
+        with span("preview_encode", format=image_format):
+            pillow_format, _, options = PREVIEW_FORMATS[image_format]
+            image.save(buffer, format=pillow_format, **options)
+        log(f"Preview generated: {image.width}x{image.height}, {buffer.tell()} bytes")
+        return buffer.getvalue()
+    except Exception as e:
+        log(f"Error generating preview: {str(e)}")
+        log_traceback()
+        return None
+
+# Function to collect the settings a pool of workers needs from the parent process
+# The per-host request rate is a budget for the whole run, so each worker gets an even share
+def worker_settings(workers):
+    return {"font_search_paths": FONT_SEARCH_PATHS, "quiet": QUIET_MODE, "capture_spans": _metrics_sink is not None,
+            "http_rate_limits": {host: rate / workers for host, rate in HTTP_RATE_LIMITS.items()},
+            "http_burst": max(1.0, HTTP_BURST / workers), "output_profile": OUTPUT_PROFILE, "cover_dpi": COVER_DPI,
+            "cover_quality": COVER_QUALITY, "offline": OFFLINE_MODE, "metadata_ttl": METADATA_CACHE_TTL}
+
+# Function to prepare a pool worker process: apply the parent's settings and load fonts up front
+# Workers never write metrics themselves; their spans are buffered and returned with each result
+def init_worker(settings):
+    global FONT_SEARCH_PATHS, QUIET_MODE, HTTP_RATE_LIMITS, HTTP_BURST, _asset_executor, _spotify_client, _metrics_sink
+    global _http_session, _host_limiters, _host_limiters_lock, _cache_sizes_lock
+    global OUTPUT_PROFILE, COVER_DPI, COVER_QUALITY, OFFLINE_MODE, METADATA_CACHE_TTL
+    # A forked worker inherits the parent's thread pool, clients and locks but not their threads
+    # or sockets, so start from scratch instead of submitting work to a pool that can never run it
+    _asset_executor = None
+    _spotify_client = None
+    _http_session = None
+    _host_limiters = {}
+    _host_limiters_lock = threading.Lock()
+    _cache_sizes_lock = threading.Lock()
+    HTTP_RATE_LIMITS = settings["http_rate_limits"]
+    HTTP_BURST = settings["http_burst"]
+    FONT_SEARCH_PATHS = settings["font_search_paths"]
+    QUIET_MODE = settings["quiet"]
+    # Spawned workers start from the environment, so the command line's profile has to be passed on
+    # or the poster would not match the manifest the parent hashed for it
+    OUTPUT_PROFILE = settings["output_profile"]
+    COVER_DPI = settings["cover_dpi"]
+    COVER_QUALITY = settings["cover_quality"]
+    # Service workers fetch album details themselves, so they must honour --offline and --metadata-ttl too
+    OFFLINE_MODE = settings["offline"]
+    METADATA_CACHE_TTL = settings["metadata_ttl"]
+    _metrics_sink = _span_buffer.append if settings["capture_spans"] else None
+    drain_span_events()
+    get_font_registry()
+
+# Function to render one album poster end to end; runs inside a batch worker process
+# album_details can be passed in when the metadata was already fetched in bulk, and pdf_file
+# when the batch chose the poster's path (default: its usual name in the current directory)
+def render_album(album_url, album_details=None, pdf_file=None):
+    result = render_album_in_worker(album_url, album_details, pdf_file)
+    result["spans"] = drain_span_events()
+    return result
+
+# Function to do the actual work of render_album
+def render_album_in_worker(album_url, album_details, pdf_file=None):
+    try:
+        if album_details is None:
+            album_details = get_album_details(album_url)
+        if not album_details["success"]:
+            return {"album_url": album_url, "success": False,
+                    "error": album_details.get("error", "Unknown error")}
+
+        assets = start_asset_downloads(album_details)
+        pdf_file = generate_pdf(album_details, assets, output=pdf_file)
+        if not pdf_file:
+            return {"album_url": album_url, "success": False, "error": "Failed to generate PDF"}
+
+        return {"album_url": album_url, "success": True, "pdf_file": pdf_file}
+    except Exception as e:
+        log(f"Error rendering album {album_url}: {str(e)}")
+        log_traceback()
+        return {"album_url": album_url, "success": False, "error": str(e)}
+
+# Function to read album URLs from a file (or stdin for "-"), skipping blank lines and # comments
+def read_album_urls(source):
+    stream = sys.stdin if source == "-" else open(source, encoding="utf-8")
+    try:
+        for line in stream:
+            album_url = line.strip()
+            if album_url and not album_url.startswith("#"):
+                yield album_url
+    finally:
+        if stream is not sys.stdin:
+            stream.close()
+
+# Function to pair each album URL with its details, fetching metadata in bulk chunks as URLs stream in
+def iter_album_details(album_urls):
+    album_urls = iter(album_urls)
+    while True:
+        chunk = list(itertools.islice(album_urls, SPOTIFY_ALBUMS_BATCH_SIZE))
+        if not chunk:
+            return
+        yield from zip(chunk, get_albums_details(chunk))
+
+# Function to collect the result of a finished worker future for album_url
+def batch_future_result(future, album_url):
+    try:
+        return future.result()
+    except Exception as e:
+        return {"album_url": album_url, "success": False, "error": str(e)}
+
+# Function to print the outcome of one batch album and update the summary counts
+def report_batch_result(result, summary):
+    emit_span_events(result.get("spans", []))
+    if result.get("unchanged"):
+        summary["unchanged"] += 1
+        print(f"[UNCHANGED] {result['album_url']} -> {result['pdf_file']}")
+    elif result["success"]:
+        summary["succeeded"] += 1
+        print(f"[OK] {result['album_url']} -> {result['pdf_file']}")
+    else:
+        summary["failed"] += 1
+        summary["failures"].append(result)
+        print(f"[FAILED] {result['album_url']}: {result['error']}")
+
+# Function to check whether an album's poster at pdf_file was rendered from the same inputs
+# Returns the poster's path when it is up to date, None when it has to be (re-)rendered
+def up_to_date_poster(album_details, pdf_file):
+    manifest_hash = read_pdf_manifest_hash(pdf_file)
+    if manifest_hash is None or manifest_hash != render_manifest_hash(album_details):
+        return None
+    return pdf_file
+
+# Function to render many albums on a process pool, keeping at most max_in_flight jobs queued
+# Posters whose inputs have not changed since they were last rendered are skipped unless force is set
+# Releases that share artist and title get the album ID in their file name, so none overwrites another
+def run_batch(album_urls, workers=None, max_in_flight=None, force=False):
+    from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+    from concurrent.futures.process import BrokenProcessPool
+    workers = workers or os.cpu_count() or 1
+    max_in_flight = max(max_in_flight or workers * 2, workers)
+    log(f"Starting batch run with {workers} workers (max {max_in_flight} albums in flight)")
+
+    summary = {"succeeded": 0, "unchanged": 0, "failed": 0, "failures": []}
+    executor = None
+    in_flight = {}  # future -> (album_url, album_details, pdf_file, attempt)
+    claimed_names = set()  # Lower case, as on case-insensitive file systems
+
+    def submit(album_url, album_details, pdf_file, attempt=1):
+        nonlocal executor
+        if executor is None:
+            executor = ProcessPoolExecutor(max_workers=workers, initializer=init_worker,
+                                           initargs=(worker_settings(workers),))
+        try:
+            future = executor.submit(render_album, album_url, album_details, pdf_file)
+            in_flight[future] = (album_url, album_details, pdf_file, attempt)
+        except BrokenProcessPool:
+            # The pool broke since the last result was collected; restart it with this album queued
+            restart_pool([(album_url, album_details, pdf_file, attempt - 1)])
+
+    def restart_pool(retries):
+        # Every future of a broken pool fails, so wait for the rest of them before starting a new one
+        nonlocal executor
+        for future in wait(in_flight).done:
+            album_url, album_details, pdf_file, attempt = in_flight.pop(future)
+            try:
+                report_batch_result(future.result(), summary)
+            except BrokenProcessPool:
+                retries.append((album_url, album_details, pdf_file, attempt))
+            except Exception as e:
+                report_batch_result({"album_url": album_url, "success": False, "error": str(e)}, summary)
+        executor.shutdown(wait=True)
+        executor = None
+        log(f"A batch worker process died; retrying its {len(retries)} albums one at a time")
+        for album_url, album_details, pdf_file, attempt in retries:
+            if attempt >= BATCH_RENDER_ATTEMPTS:
+                report_batch_result({"album_url": album_url, "success": False,
+                                     "error": "A worker process died while rendering it"}, summary)
+                continue
+            submit(album_url, album_details, pdf_file, attempt + 1)
+            collect(wait(in_flight).done)
+
+    def collect(done):
+        retries = []
+        for future in done:
+            album_url, album_details, pdf_file, attempt = in_flight.pop(future)
+            if isinstance(future.exception(), BrokenProcessPool):
+                retries.append((album_url, album_details, pdf_file, attempt))
             else:
-                # Reduce font sizes and try again, but ensure they don't go below minimums
-                album_title_size = max(int(album_title_size * 0.9), min_album_title_size)
-                tracklist_size = max(int(tracklist_size * 0.9), min_tracklist_size)
-                font_reduction_attempts += 1
-                print(f"Reducing font sizes (attempt {font_reduction_attempts}): Album title {album_title_size}, Tracklist {tracklist_size}")
-                
-                # If we've reached minimum sizes and still can't fit, break out of loop
-                if album_title_size == min_album_title_size and tracklist_size == min_tracklist_size:
-                    print("Reached minimum font sizes. Some content may be cut off.")
-                    break
-        
-        print(f"Final font sizes: Album title {album_title_size}, Tracklist {tracklist_size}")
-        
-        # Now draw actual content with the calculated font sizes
-        
-        # Draw album title with text wrapping (limited to 2 lines)
-        print(f"Adding album title with font size {album_title_size}")
-        c.setFont("Helvetica-Bold", album_title_size)
-        # MODIFIED: Use more horizontal space for album title
-        max_album_title_width = width - 2 * margin - 100  # Reduced from 200 to 100
-        
-        # Draw album title (max 2 lines)
-        new_y, title_lines, last_line_width = draw_wrapped_text(c, album_name, margin, title_y, 
-                                                               max_album_title_width, album_title_size + 5, 
-                                                               font_name, album_title_size)
-        
-        # If the album name fits on one line, draw artist name on the same line
-        # Otherwise, draw it at the end of the second line
-        if title_lines == 1:
-            # Draw artist name on the same line
-            artist_x = margin + last_line_width + 10  # Add some spacing
-            artist_y = title_y
+                report_batch_result(batch_future_result(future, album_url), summary)
+        if retries:
+            restart_pool(retries)
+
+    try:
+        for album_url, album_details in iter_album_details(iter_source_album_urls(album_urls, summary)):
+            if not album_details["success"]:
+                report_batch_result({"album_url": album_url, "success": False,
+                                     "error": album_details.get("error", "Unknown error")}, summary)
+                continue
+
+            filename = poster_filename(album_details)
+            if filename.lower() in claimed_names:
+                filename = poster_filename(album_details, with_album_id=True)
+            claimed_names.add(filename.lower())
+            pdf_file = os.path.join(os.getcwd(), filename)
+            if not force and up_to_date_poster(album_details, pdf_file):
+                report_batch_result({"album_url": album_url, "success": True, "unchanged": True,
+                                     "pdf_file": pdf_file}, summary)
+                continue
+
+            # Block until a slot frees up so huge catalogs never get queued all at once
+            if len(in_flight) >= max_in_flight:
+                collect(wait(in_flight, return_when=FIRST_COMPLETED).done)
+            submit(album_url, album_details, pdf_file)
+
+        while in_flight:
+            collect(wait(in_flight, return_when=FIRST_COMPLETED).done)
+    finally:
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
+
+    print(f"Batch finished: {summary['succeeded']} rendered, {summary['unchanged']} unchanged, "
+          f"{summary['failed']} failed")
+    return summary
+
+# Function to render many albums as the pages of one PDF catalog, written to output (a path or a stream)
+# Fonts are embedded once, the background and border are shared forms, and ReportLab embeds each distinct
+# image once. Downloads and decoded images are bounded by CATALOG_PREFETCH, but the canvas keeps every page
+# stream and embedded image until save(), so memory grows with the catalog, roughly by the size of the PDF
+def generate_catalog(album_urls, output):
+    from reportlab.pdfgen import canvas
+    summary = {"succeeded": 0, "unchanged": 0, "failed": 0, "failures": []}
+    # Same stream settings as generate_pdf, so --profile means the same in catalog mode
+    c = canvas.Canvas(output, pagesize=A4, pageCompression=output_profile()["page_compression"])
+    shared_forms = {}
+    pending = collections.deque()
+    page_count = 0
+
+    def draw_next():
+        nonlocal page_count
+        album_details, assets = pending.popleft()
+        album_url = album_details["album_url"]
+        try:
+            plan = draw_poster(c, album_details, assets, shared_forms)
+            c.showPage()
+        except Exception as e:
+            log(f"Error drawing catalog page for {album_url}: {str(e)}")
+            log_traceback()
+            report_batch_result({"album_url": album_url, "success": False, "error": str(e)}, summary)
+            return
+        report_batch_result({"album_url": album_url, "success": True,
+                             "pdf_file": f"page {page_count + 1}"}, summary)
+        page_count += len(plan.pages)
+
+    log(f"Starting catalog with up to {CATALOG_PREFETCH} albums prefetched ({OUTPUT_PROFILE} profile)")
+    # Streams are created as pages are drawn, so the profile's encoding applies until the save
+    with pdf_stream_encoding(output_profile()):
+        for album_url, album_details in iter_album_details(iter_source_album_urls(album_urls, summary)):
+            if not album_details["success"]:
+                report_batch_result({"album_url": album_url, "success": False,
+                                     "error": album_details.get("error", "Unknown error")}, summary)
+                continue
+            pending.append((album_details, start_asset_downloads(album_details)))
+            if len(pending) > CATALOG_PREFETCH:
+                draw_next()
+        while pending:
+            draw_next()
+
+        if page_count:
+            with span("pdf_save", pages=page_count, profile=OUTPUT_PROFILE):
+                c.save()
+    print(f"Catalog finished: {summary['succeeded']} albums on {page_count} pages, {summary['failed']} failed")
+    return summary
+
+# Function to switch a service worker to the output profile of the request it is rendering
+# Each worker process renders one request at a time, so the process-wide setting is safe to change
+def use_output_profile(profile):
+    global OUTPUT_PROFILE
+    OUTPUT_PROFILE = profile
+
+# Function to render one album to PDF bytes; runs inside a service worker process
+# The PDF is built in memory, so workers never touch the disk or collide on file names
+def render_album_pdf(album_url, profile):
+    use_output_profile(profile)
+    result = render_album_pdf_in_worker(album_url)
+    result["spans"] = drain_span_events()
+    return result
+
+# Function to do the actual work of render_album_pdf
+def render_album_pdf_in_worker(album_url):
+    try:
+        album_details = get_album_details(album_url)
+        if not album_details["success"]:
+            return {"success": False, "error": album_details.get("error", "Unknown error")}
+
+        buffer = BytesIO()
+        pdf_filename = generate_pdf(album_details, output=buffer)
+        if not pdf_filename:
+            return {"success": False, "error": "Failed to generate PDF"}
+        return {"success": True, "filename": pdf_filename, "pdf_bytes": buffer.getvalue()}
+    except Exception as e:
+        log(f"Error rendering album {album_url}: {str(e)}")
+        log_traceback()
+        return {"success": False, "error": str(e)}
+
+# Function to render one album's preview image; runs inside a service worker process
+def render_album_preview(album_url, profile, width, image_format):
+    use_output_profile(profile)
+    result = render_album_preview_in_worker(album_url, width, image_format)
+    result["spans"] = drain_span_events()
+    return result
+
+# Function to do the actual work of render_album_preview
+def render_album_preview_in_worker(album_url, width, image_format):
+    try:
+        album_details = get_album_details(album_url)
+        if not album_details["success"]:
+            return {"success": False, "error": album_details.get("error", "Unknown error")}
+
+        image_bytes = render_preview(album_details, width=width, image_format=image_format)
+        if not image_bytes:
+            return {"success": False, "error": "Failed to generate preview"}
+        return {"success": True, "filename": poster_filename(album_details, f".{image_format}"),
+                "image_bytes": image_bytes}
+    except Exception as e:
+        log(f"Error rendering preview of album {album_url}: {str(e)}")
+        log_traceback()
+        return {"success": False, "error": str(e)}
+
+# Function to submit a render to the service pool, sharing one render between concurrent
+# requests for the same album instead of rendering it once per request
+# preview is None for the PDF, or (width, image format) for a preview image
+def submit_coalesced_render(server, album_url, profile, preview=None):
+    key = (extract_album_id(album_url), profile, preview)
+    with server.in_flight_lock:
+        future = server.in_flight.get(key)
+        if future is not None:
+            log(f"Joining in-flight render for album: {key[0]}")
+            return future
+        if preview is None:
+            future = server.render_pool.submit(render_album_pdf, album_url, profile)
         else:
-            # Draw artist name on the second line (at the end)
-            artist_x = margin + last_line_width + 10  # Add some spacing
-            artist_y = new_y + album_title_size + 5
-        
-        # Draw artist name
-        print(f"Adding artist name with font size {tracklist_size}")
-        c.setFont(font_name, tracklist_size)
-        c.drawString(artist_x, artist_y, artist_name)
-        
-        # Calculate starting position for tracklist
-        tracklist_y = new_y - title_to_tracklist_spacing
-        
-        # Draw tracklist in two columns with text wrapping
-        print(f"Adding tracklist with font size {tracklist_size}")
-        c.setFont(font_name, tracklist_size)
-        line_height = tracklist_size + 5
-        
-        # Calculate number of tracks for each column (divide evenly)
-        first_column_tracks = len(tracks) // 2
-        if len(tracks) % 2 != 0:  # If odd number of tracks, put extra one in first column
-            first_column_tracks += 1
+            future = server.render_pool.submit(render_album_preview, album_url, profile, *preview)
+        server.in_flight[key] = future
+
+    def forget(finished):
+        with server.in_flight_lock:
+            if server.in_flight.get(key) is finished:
+                del server.in_flight[key]
+        # Record the render's spans once, however many requests shared it
+        if not finished.cancelled() and finished.exception() is None:
+            emit_span_events(finished.result().get("spans", []))
+    future.add_done_callback(forget)
+    return future
+
+# Request handler classes for the rendering service and /metrics, as (metrics, poster)
+# Created on first use so commands that never serve HTTP don't import http.server
+_request_handlers = None
+
+# Function to return the request handler classes, defining them on first use
+def get_request_handlers():
+    global _request_handlers
+    if _request_handlers is None:
+        import concurrent.futures
+        from http.server import BaseHTTPRequestHandler
+
+        class MetricsRequestHandler(BaseHTTPRequestHandler):
+            # GET /metrics returns the span histograms in the Prometheus text format
+            def do_GET(self):
+                if urllib.parse.urlsplit(self.path).path == "/metrics":
+                    self.send_text(200, render_prometheus_metrics(), "text/plain; version=0.0.4; charset=utf-8")
+                else:
+                    self.send_text(404, "Not found")
+
+            def send_text(self, status, text, content_type="text/plain; charset=utf-8"):
+                body = text.encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                if not QUIET_MODE:
+                    super().log_message(format, *args)
+
+        class PosterRequestHandler(MetricsRequestHandler):
+            # GET /poster?url=<spotify album url>[&profile=print|web] returns the poster PDF
+            # GET /preview?url=<spotify album url>[&width=600][&format=png|webp] returns a preview image
+            # GET /health is a liveness check
+            def do_GET(self):
+                request = urllib.parse.urlsplit(self.path)
+                if request.path == "/metrics":
+                    super().do_GET()
+                    return
+                if request.path == "/health":
+                    self.send_text(200, "ok")
+                    return
+                if request.path not in ("/poster", "/preview"):
+                    self.send_text(404, "Not found")
+                    return
+
+                query = urllib.parse.parse_qs(request.query)
+                album_url = query.get("url", [""])[0]
+                error = validate_album_url(album_url)
+                if error:
+                    self.send_text(400, f"Expected ?url=<Spotify album URL>: {error}")
+                    return
+
+                profile = query.get("profile", [OUTPUT_PROFILE])[0]
+                if profile not in OUTPUT_PROFILES:
+                    self.send_text(400, f"profile must be one of: {', '.join(OUTPUT_PROFILES)}")
+                    return
+
+                preview = None
+                if request.path == "/preview":
+                    width = query.get("width", [str(PREVIEW_WIDTH)])[0]
+                    image_format = query.get("format", ["png"])[0].lower()
+                    if not width.isdigit() or not 0 < int(width) <= PREVIEW_MAX_WIDTH:
+                        self.send_text(400, f"width must be a number of pixels up to {PREVIEW_MAX_WIDTH}")
+                        return
+                    if image_format not in PREVIEW_FORMATS:
+                        self.send_text(400, f"format must be one of: {', '.join(PREVIEW_FORMATS)}")
+                        return
+                    preview = (int(width), image_format)
+
+                try:
+                    future = submit_coalesced_render(self.server, album_url, profile, preview)
+                    result = future.result(timeout=SERVICE_RENDER_TIMEOUT)
+                except concurrent.futures.TimeoutError:
+                    self.send_text(504, "Rendering timed out")
+                    return
+                except Exception as e:
+                    self.send_text(500, f"Rendering failed: {str(e)}")
+                    return
+
+                if not result["success"]:
+                    self.send_text(502, result["error"])
+                    return
+
+                if preview is None:
+                    body, content_type = result["pdf_bytes"], "application/pdf"
+                else:
+                    body, content_type = result["image_bytes"], PREVIEW_FORMATS[preview[1]][1]
+                self.send_response(200)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.send_header("Content-Disposition", content_disposition(result["filename"]))
+                self.end_headers()
+                self.wfile.write(body)
+
+        _request_handlers = (MetricsRequestHandler, PosterRequestHandler)
+    return _request_handlers
+
+# Function to expose /metrics on its own port for batch and interactive runs
+def start_metrics_server(port, host="127.0.0.1"):
+    from http.server import ThreadingHTTPServer
+    metrics_handler, _ = get_request_handlers()
+    server = ThreadingHTTPServer((host, port), metrics_handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="posterfy-metrics", daemon=True).start()
+    log(f"Serving metrics on http://{host}:{port}/metrics")
+    return server
+
+# Function to turn SIGTERM into the same shutdown path as Ctrl+C
+def raise_keyboard_interrupt(signum, frame):
+    raise KeyboardInterrupt
+
+# Function to run the local rendering service on a warm pool of worker processes
+def serve(host, port, workers=None):
+    from concurrent.futures import ProcessPoolExecutor
+    workers = workers or os.cpu_count() or 1
+    # The service always answers /metrics, so collect span histograms unless another sink was chosen
+    if _metrics_sink is None:
+        configure_metrics("prometheus")
+    from http.server import ThreadingHTTPServer
+    render_pool = ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=(worker_settings(workers),))
+    server = None
+    previous_sigterm = None
+    try:
+        # Start every worker now so the first requests don't pay for process start-up and font loading
+        for future in [render_pool.submit(os.getpid) for _ in range(workers)]:
+            future.result()
+
+        _, poster_handler = get_request_handlers()
+        server = ThreadingHTTPServer((host, port), poster_handler)
+        server.render_pool = render_pool
+        server.in_flight = {}
+        server.in_flight_lock = threading.Lock()
+        print(f"Serving posters on http://{host}:{port}/poster?url=<album url> with {workers} workers")
+        # Installed after the workers have started, so only the service process handles it;
+        # Python only delivers signals to the main thread, so an embedded service skips it
+        if threading.current_thread() is threading.main_thread():
+            previous_sigterm = signal.signal(signal.SIGTERM, raise_keyboard_interrupt)
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("Shutting down")
+    finally:
+        if previous_sigterm is not None:
+            signal.signal(signal.SIGTERM, previous_sigterm)
+        if server is not None:
+            server.server_close()
+        render_pool.shutdown(cancel_futures=True)
+
+# Function to parse command line options
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Generate stylized posters for Spotify albums.")
+    parser.add_argument("--batch", metavar="FILE",
+                        help="render every album URL listed in FILE, one per line (use - to read stdin); "
+                             "artist and playlist URLs render all of their albums")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="number of worker processes for batch and service mode (default: CPU count)")
+    parser.add_argument("--max-in-flight", type=int, default=None,
+                        help="maximum number of albums queued on the pool at once (default: 2x workers)")
+    parser.add_argument("--force", action="store_true",
+                        help="in batch mode, re-render posters even when their inputs have not changed")
+    parser.add_argument("--catalog", metavar="FILE",
+                        help="render every album (or artist or playlist) URL listed in FILE into a single PDF (see --output)")
+    parser.add_argument("--cache-info", action="store_true",
+                        help="print what the local metadata and asset caches hold, then exit")
+    parser.add_argument("--validate", nargs="+", metavar="URL",
+                        help="check album URLs offline and print their album IDs, then exit")
+    parser.add_argument("--serve", action="store_true",
+                        help="run a local HTTP service that returns poster PDFs for album URLs")
+    parser.add_argument("--host", default="127.0.0.1", help="address for --serve to listen on (default: 127.0.0.1)")
+    parser.add_argument("--port", type=int, default=8080, help="port for --serve to listen on (default: 8080)")
+    parser.add_argument("--offline", action="store_true",
+                        help="serve album details from the local cache only, without calling the Spotify API")
+    parser.add_argument("--metadata-ttl", type=int, default=None, metavar="SECONDS",
+                        help=f"how long cached album details stay fresh (default: {METADATA_CACHE_TTL})")
+    parser.add_argument("--font-path", action="append", default=[], metavar="DIR",
+                        help="extra directory to search for poster fonts (can be repeated)")
+    parser.add_argument("--output", "-o", metavar="FILE",
+                        help="write the poster (or --catalog, default catalog.pdf) to FILE instead of the current directory "
+                             "(use - for stdout)")
+    parser.add_argument("--preview", type=int, nargs="?", const=PREVIEW_WIDTH, metavar="WIDTH",
+                        help=f"write a PNG preview WIDTH pixels wide (default: {PREVIEW_WIDTH}) instead of the PDF; "
+                             "an --output ending in .webp writes WebP")
+    parser.add_argument("--profile", choices=sorted(OUTPUT_PROFILES), default=None,
+                        help=f"output profile: print (full resolution, lossless) or web (small files) "
+                             f"(default: {OUTPUT_PROFILE})")
+    parser.add_argument("--cover-dpi", type=float, default=None,
+                        help="resolution to prepare the album cover for (default: the output profile's)")
+    parser.add_argument("--cover-quality", type=int, default=None,
+                        help="JPEG quality (1-95) of a resized album cover (default: the output profile's)")
+    parser.add_argument("--quiet", action="store_true",
+                        help="only print results and failures, not the step-by-step diagnostics")
+    parser.add_argument("--metrics", default=None, metavar="SINK",
+                        help="where to send per-stage timings: none, jsonl:FILE (- for stderr) or "
+                             f"prometheus[:PORT] (default: {METRICS_SINK})")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    global OFFLINE_MODE, METADATA_CACHE_TTL, FONT_SEARCH_PATHS, QUIET_MODE, COVER_DPI, COVER_QUALITY, OUTPUT_PROFILE
+    args = parse_args(argv)
+    if args.preview is not None and not 0 < args.preview <= PREVIEW_MAX_WIDTH:
+        sys.exit(f"--preview width must be between 1 and {PREVIEW_MAX_WIDTH} pixels")
+    if args.quiet:
+        QUIET_MODE = True
+    if args.profile:
+        OUTPUT_PROFILE = args.profile
+    if OUTPUT_PROFILE not in OUTPUT_PROFILES:
+        sys.exit(f"Unknown output profile {OUTPUT_PROFILE!r}; choose one of: {', '.join(OUTPUT_PROFILES)}")
+    if COVER_RESIZE_FILTER not in COVER_RESIZE_FILTERS:
+        sys.exit(f"Unknown POSTERFY_COVER_FILTER {COVER_RESIZE_FILTER!r}; choose one of: {', '.join(COVER_RESIZE_FILTERS)}")
+    if INVALID_HTTP_RATE_LIMITS:
+        sys.exit(f"Invalid POSTERFY_HTTP_RATE_LIMITS entries: {', '.join(map(repr, INVALID_HTTP_RATE_LIMITS))}; "
+                 "expected comma-separated host=rate pairs, e.g. api.spotify.com=10")
+    if args.cover_dpi is not None:
+        COVER_DPI = args.cover_dpi
+    if args.cover_quality is not None:
+        COVER_QUALITY = args.cover_quality
+    if COVER_QUALITY and not 1 <= COVER_QUALITY <= 95:
+        sys.exit(f"Cover quality must be between 1 and 95, not {COVER_QUALITY}")
+    metrics_spec = args.metrics or METRICS_SINK
+    metrics_error = metrics_sink_error(metrics_spec)
+    if metrics_error:
+        sys.exit(metrics_error)
+    try:
+        configure_metrics(metrics_spec)
+    except OSError as e:
+        sys.exit(f"Cannot start metrics sink {metrics_spec!r}: {e}")
+    # Applied before --cache-info, whose expired count depends on them
+    if args.font_path:
+        FONT_SEARCH_PATHS = args.font_path + FONT_SEARCH_PATHS
+    if args.offline:
+        OFFLINE_MODE = True
+    if args.metadata_ttl is not None:
+        METADATA_CACHE_TTL = args.metadata_ttl
+
+    if args.cache_info:
+        info = cache_info()
+        print(f"Cache directory: {info['cache_dir']}")
+        print(f"Metadata: {info['metadata']['entries']} albums ({info['metadata']['expired']} expired, "
+              f"TTL {METADATA_CACHE_TTL}s, limit {METADATA_CACHE_MAX_ENTRIES}), {info['metadata']['bytes']} bytes")
+        print(f"Assets: {info['assets']['entries']} files, {info['assets']['bytes']} of {ASSET_CACHE_MAX_BYTES} bytes")
+        return
+
+    if args.validate:
+        invalid = 0
+        for album_url in args.validate:
+            error = validate_album_url(album_url)
+            if error:
+                invalid += 1
+                print(f"[INVALID] {album_url}: {error}")
+            else:
+                print(f"[OK] {album_url} -> {extract_album_id(album_url)}")
+        if invalid:
+            sys.exit(1)
+        return
+
+    if args.serve:
+        serve(args.host, args.port, args.workers)
+        return
+
+    if args.batch:
+        summary = run_batch(read_album_urls(args.batch), args.workers, args.max_in_flight, args.force)
+        if summary["failed"]:
+            sys.exit(1)
+        return
+
+    if args.catalog:
+        output = args.output or "catalog.pdf"
+        if output == "-":
+            # The PDF owns stdout, so progress and results move to stderr
+            with contextlib.redirect_stdout(sys.stderr):
+                summary = generate_catalog(read_album_urls(args.catalog), sys.stdout.buffer)
+            sys.stdout.buffer.flush()
+        else:
+            summary = generate_catalog(read_album_urls(args.catalog), output)
+        if summary["failed"]:
+            sys.exit(1)
+        return
+
+    if args.output == "-":
+        # The PDF owns stdout, so every message (and the input prompt) moves to stderr
+        pdf_stream = sys.stdout.buffer
+        with contextlib.redirect_stdout(sys.stderr):
+            create_poster(pdf_stream, args.preview)
+        pdf_stream.flush()
+    else:
+        create_poster(args.output, args.preview)
+
+# Function to render a preview image and write it to output (a file path or a writable binary stream),
+# by default next to where the PDF would go; returns the name written, or None on failure
+def write_preview(album_details, assets, output, width):
+    image_format = "webp" if isinstance(output, str) and output.lower().endswith(".webp") else "png"
+    image_bytes = render_preview(album_details, assets, width, image_format)
+    if not image_bytes:
+        return None
+    if output is None:
+        output = poster_filename(album_details, f".{image_format}")
+    if isinstance(output, str):
+        with open(output, "wb") as f:
+            f.write(image_bytes)
+        return output
+    output.write(image_bytes)
+    return poster_filename(album_details, f".{image_format}")
+
+# Function to ask for an album URL and render its poster to the current directory,
+# or to output (a file path or a writable binary stream); with preview_width, a preview image instead
+def create_poster(output=None, preview_width=None):
+    print("Starting Spotify Album PDF Generator")
+    try:
+        # Get album URL from user
+        album_url = input("Enter Spotify album URL: ")
         
-        # Calculate lowest y-position of tracklist to ensure no overlap with Spotify code
-        lowest_y_allowed = spotify_code_y + spotify_code_height + 15  # 15px buffer
+        # Artist and playlist links expand to many posters, which is what batch mode is for
+        match = SOURCE_URL_PATTERN.fullmatch(album_url.strip())
+        if match and match.group(1) != "album":
+            print(f"That is a {match.group(1)} link; render all of its albums with --batch or --catalog")
+            return
         
-        # Draw first column
-        current_y = tracklist_y
-        for i in range(first_column_tracks):
-            if i < len(tracks) and current_y > lowest_y_allowed:
-                track_name = tracks[i]
-                new_y, _, _ = draw_wrapped_text(c, track_name, margin, current_y, 
-                                               first_column_width, line_height, font_name, tracklist_size)
-                # Move to next track position
-                current_y = new_y - 2  # Small extra spacing
+        # Get album details
+        album_details = get_album_details(album_url)
         
-        # Draw second column
-        current_y = tracklist_y
-        second_column_x = width / 2 + 10
-        for i in range(first_column_tracks, len(tracks)):
-            # Check if we're past the start of the Spotify code area and if the track would stretch into it
-            track_name = tracks[i]
-            if current_y > spotify_code_y + spotify_code_height + 15:  # Add buffer
-                new_y, _, _ = draw_wrapped_text(c, track_name, second_column_x, current_y, 
-                                               second_column_width, line_height, font_name, tracklist_size)
-                # Move to next track position
-                current_y = new_y - 2  # Small extra spacing
+        if not album_details["success"]:
+            print(f"Failed to get album details: {album_details.get('error', 'Unknown error')}")
+            return
         
-        # Draw Spotify code in bottom right corner with its new dimensions
-        if spotify_code_path:
-            print(f"Adding Spotify code at position ({spotify_code_x}, {spotify_code_y})")
-            c.drawImage(spotify_code_path, spotify_code_x, spotify_code_y, 
-                        width=spotify_code_width, height=spotify_code_height)
+        # Start cover and Spotify code downloads as soon as the metadata is in
+        assets = start_asset_downloads(album_details)
+
+        if preview_width:
+            preview_file = write_preview(album_details, assets, output, preview_width)
+            print(f"Preview successfully generated: {preview_file}" if preview_file else "Failed to generate preview")
+            return
         
-        # MODIFIED: Draw the black border with a gap of border_width from the edge
-        # Instead of drawing at (0, 0), draw at (border_width, border_width)
-        # And reduce the width and height by 2*border_width
-        c.setStrokeColor(black)
-        c.setLineWidth(border_width)
-        c.rect(
-            border_width,           # x position - offset by border_width from the edge
-            border_width,           # y position - offset by border_width from the edge
-            width - 2*border_width, # width reduced by 2*border_width
-            height - 2*border_width,# height reduced by 2*border_width
-            fill=0, 
-            stroke=1
-        )
+        # Generate PDF
+        pdf_file = generate_pdf(album_details, assets, output=output)
         
-        print("Saving PDF")
-        c.save()
-        print(f"PDF successfully generated: {pdf_filename}")
-        return pdf_filename
+        if pdf_file and output is not None:
+            print(f"PDF successfully generated: {pdf_file}")
+        elif pdf_file:
+            print(f"PDF successfully generated: {pdf_file}")
+            print(f"You can find your album poster in the current directory")
+        else:
+            print("Failed to generate PDF")
+    
     except Exception as e:
-        print(f"Error generating PDF: {str(e)}")
-        print(traceback.format_exc())
-        return None
-
-def main():
-    # Create temporary directory for files
-    print("Starting Spotify Album PDF Generator")
-    with tempfile.TemporaryDirectory() as temp_dir:
-        print(f"Created temporary directory: {temp_dir}")
-        try:
-            # Get album URL from user
-            album_url = input("Enter Spotify album URL: ")
-            
-            # Get album details
-            album_details = get_album_details(album_url)
-            
-            if not album_details["success"]:
-                print(f"Failed to get album details: {album_details.get('error', 'Unknown error')}")
-                return
-            
-            # Generate PDF
-            pdf_file = generate_pdf(album_details, temp_dir)
-            
-            if pdf_file:
-                print(f"PDF successfully generated: {pdf_file}")
-                print(f"You can find your album poster in the current directory")
-            else:
-                print("Failed to generate PDF")
-        
-        except Exception as e:
-            print(f"An error occurred: {str(e)}")
-            print(traceback.format_exc())
+        print(f"An error occurred: {str(e)}")
+        log_traceback()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,10 @@
+# Lightweight entry point for Posterify
+# Running posterfy.py directly makes Python recompile the whole script on every start; importing it
+# from here reuses its cached bytecode, so quick commands such as --cache-info and --validate
+# start in a few tens of milliseconds
+import sys
+
+import posterfy
+
+if __name__ == "__main__":
+    sys.exit(posterfy.main())